@@ -0,0 +1,63 @@
+"""Compares frame quantization for the 7-color panels.
+
+    python python/benchmarks/quantizer_benchmark.py [--image resources/default.jpg] [--size 640x400] [--repeat 5]
+
+Reports the median latency of the previous Pillow conversion (color boost, then
+`im.convert('P', True, palette)`) and of `Quantizer` in every dither mode on the same
+image, and how many pixels each mode maps to the same palette index as the old conversion.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from service.quantizer import ACEP_PALETTE_RGB, DITHER_MODES, Quantizer  # noqa: E402
+
+SATURATION = 2
+
+
+def old_convert(image):
+    image = ImageEnhance.Color(image).enhance(SATURATION)
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette([c for color in ACEP_PALETTE_RGB for c in color] + [0, 0, 0] * 248)
+    image.load()
+    palette_image.load()
+    return np.asarray(image._new(image.im.convert('P', True, palette_image.im)))
+
+
+def measure(func, image, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(image)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image', default=os.path.join(os.path.dirname(__file__), '..', '..', 'resources',
+                                                        'default.jpg'))
+    parser.add_argument('--size', default='640x400')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    size = tuple(int(side) for side in args.size.split('x'))
+    image = Image.open(args.image).convert('RGB').resize(size)
+    print(f'{os.path.basename(args.image)} at {size[0]}x{size[1]}, median of {args.repeat} runs')
+    print(f'{"method":<28}{"latency ms":>12}{"same index":>12}')
+    latency, reference = measure(old_convert, image, args.repeat)
+    print(f'{"old Pillow conversion":<28}{latency * 1000:>12.1f}{1:>12.1%}')
+    for dither in DITHER_MODES:
+        quantizer = Quantizer(ACEP_PALETTE_RGB, dither=dither, color_boost=SATURATION)
+        latency, indices = measure(quantizer.quantize, image, args.repeat)
+        print(f'{"Quantizer " + dither:<28}{latency * 1000:>12.1f}{np.mean(indices == reference):>12.1%}')
+
+
+if __name__ == '__main__':
+    main()
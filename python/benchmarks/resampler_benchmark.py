@@ -0,0 +1,73 @@
+"""Compares the 44.1 kHz -> 16 kHz resampling used by AudioService.
+
+    python python/benchmarks/resampler_benchmark.py [--seconds 10] [--repeat 5]
+
+Reports median latency and peak traced memory of scipy's FFT `resample` (the previous
+implementation), the one-shot `PolyphaseResampler` and the same resampler fed in
+1024-sample chunks the way the streaming capture callback does.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.signal import resample
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from service.resampler import PolyphaseResampler  # noqa: E402
+
+IN_RATE = 44100
+OUT_RATE = 16000
+
+
+def fft_resample(audio):
+    return resample(audio, int(len(audio) * OUT_RATE / IN_RATE))
+
+
+def polyphase_one_shot(audio, resampler=PolyphaseResampler(IN_RATE, OUT_RATE)):
+    return resampler.resample(audio)
+
+
+def polyphase_streamed(audio, resampler=PolyphaseResampler(IN_RATE, OUT_RATE), chunk=1024):
+    resampler.reset()
+    parts = [resampler.process(audio[i:i + chunk]) for i in range(0, len(audio), chunk)]
+    parts.append(resampler.flush())
+    return np.concatenate(parts)
+
+
+def measure(func, audio, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(audio)
+        latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(audio)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(latencies), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    audio = np.random.default_rng(0).uniform(-1, 1, int(args.seconds * IN_RATE)).astype(np.float32)
+    print(f'{args.seconds:g} s of audio, {len(audio)} samples, median of {args.repeat} runs')
+    print(f'{"method":<22}{"latency ms":>12}{"peak MiB":>12}')
+    for name, func in (('scipy fft resample', fft_resample),
+                       ('polyphase one-shot', polyphase_one_shot),
+                       ('polyphase streamed', polyphase_streamed)):
+        latency, peak = measure(func, audio, args.repeat)
+        print(f'{name:<22}{latency * 1000:>12.1f}{peak / 2 ** 20:>12.2f}')
+    deviation = np.abs(polyphase_one_shot(audio) - polyphase_streamed(audio)).max()
+    print(f'max |one-shot - streamed| = {deviation:.2e}')
+
+
+if __name__ == '__main__':
+    main()
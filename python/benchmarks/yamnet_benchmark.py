@@ -0,0 +1,96 @@
+"""Compares YAMNet model variants and interpreter settings for MusicDetector.
+
+    python python/benchmarks/yamnet_benchmark.py --clips DIR [--models A.tflite B.tflite]
+        [--threads 1 4] [--seconds 10] [--repeat 5]
+
+Run it from the repository root, like the service. Every model / thread count / XNNPACK
+combination runs in a fresh process and reports the median and worst `invoke` latency,
+the peak RSS of that process and how often its music decision agrees with the first
+model (the float reference) on the WAV clips in DIR. Each clip is decided on its own
+music score against the enter threshold, without the hysteresis of the service. Clips are mono or stereo 16 bit
+PCM at 16 or 44.1 kHz, cut or zero padded to `--seconds`.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from service.music_detector import MODEL_PATH, MusicDetector  # noqa: E402
+from service.resampler import PolyphaseResampler  # noqa: E402
+
+RATE = 16000
+
+
+def load_clip(path, seconds):
+    with wave.open(path) as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f'{path}: only 16 bit PCM clips are supported')
+        rate, channels = wav.getframerate(), wav.getnchannels()
+        audio = np.frombuffer(wav.readframes(wav.getnframes()), dtype='<i2').reshape(-1, channels)
+    audio = audio[:, 0].astype(np.float32) / 32768
+    if rate != RATE:
+        audio = PolyphaseResampler(rate, RATE).resample(audio)
+    clip = np.zeros(int(seconds * RATE), dtype=np.float32)
+    clip[:min(len(clip), len(audio))] = audio[:len(clip)]
+    # prepared like AudioService.normalize with its default gain
+    peak = np.max(np.abs(clip))
+    return np.clip(clip / peak * 3.0, -1.0, 1.0) if peak > 0 else clip
+
+
+def run_variant(model_path, num_threads, use_xnnpack, clips, seconds, repeat):
+    """Runs in a child process so the peak RSS belongs to this variant alone."""
+    detector = MusicDetector(int(seconds), model_path=model_path, num_threads=num_threads, use_xnnpack=use_xnnpack)
+    detector.is_audio_music(clips[0])  # warm-up, first invoke allocates and packs weights
+    latencies = []
+    decisions = []
+    for clip in clips:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            detector.is_audio_music(clip)
+            latencies.append(time.perf_counter() - start)
+        # the model's own decision on this clip, the debounced state would carry over from the previous clip
+        decisions.append(detector.last_score >= detector.hysteresis.enter_threshold)
+    # ru_maxrss is in KiB on Linux
+    return statistics.median(latencies), max(latencies), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clips', required=True, help='directory of .wav fixture clips')
+    parser.add_argument('--models', nargs='+', default=[MODEL_PATH], help='first model is the reference')
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 4])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.clips, '*.wav')))
+    if not paths:
+        parser.error(f'no .wav clips in {args.clips}')
+    clips = [load_clip(path, args.seconds) for path in paths]
+    print(f'{len(clips)} clips of {args.seconds:g} s, {args.repeat} runs each')
+    print(f'{"model":<32}{"threads":>8}{"xnnpack":>8}{"median ms":>11}{"max ms":>9}{"RSS MiB":>9}{"agree":>8}')
+    reference = None
+    context = multiprocessing.get_context('spawn')
+    for model_path in args.models:
+        for num_threads in args.threads:
+            for use_xnnpack in (True, False):
+                with context.Pool(1) as pool:
+                    median, worst, rss, decisions = pool.apply(
+                        run_variant, (model_path, num_threads, use_xnnpack, clips, args.seconds, args.repeat))
+                if reference is None:
+                    reference = decisions
+                agreement = sum(a == b for a, b in zip(decisions, reference)) / len(reference)
+                print(f'{os.path.basename(model_path):<32}{num_threads:>8}{str(use_xnnpack):>8}'
+                      f'{median * 1000:>11.1f}{worst * 1000:>9.1f}{rss / 1024:>9.1f}{agreement:>8.0%}')
+
+
+if __name__ == '__main__':
+    main()
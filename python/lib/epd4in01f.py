@@ -34,14 +34,21 @@
 #
 
 import logging
+
+import numpy as np
+
+# the palette and packer are shared with the virtual panel, which promises byte-identical frames
+from service.quantizer import ACEP_PALETTE_RGB as PALETTE_RGB, color_indices, pack_indices  # noqa: F401
 from . import epdconfig
 
 # Display resolution
 EPD_WIDTH = 640
 EPD_HEIGHT = 400
 
-logger = logging.getLogger()
+# all WHITE (0x11 = two 0001 pixels), allocated once and reused by every Clear
+CLEAR_FRAME = bytes([0x11]) * (EPD_HEIGHT * EPD_WIDTH // 2)
 
+logger = logging.getLogger()
 
 class EPD:
     def __init__(self):
@@ -99,8 +106,9 @@ class EPD:
             epdconfig.delay_ms(10)
         logger.debug("e-Paper busy release")
 
-    def init(self):
-        if (epdconfig.module_init() != 0):
+    def init(self, module_init=True):
+        # module_init=False only resets and configures the panel, for a caller that keeps GPIO and SPI open
+        if module_init and (epdconfig.module_init() != 0):
             return -1
         # EPD hardware init start
         self.reset()
@@ -136,56 +144,18 @@ class EPD:
         return 0
 
     def getbuffer(self, image):
-        buf = [0x00] * int(self.width * self.height / 2)
         image_monocolor = image.convert('RGB')  # Picture mode conversion
-        imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
+        return self.getbuffer_indices(color_indices(np.asarray(image_monocolor)))
+
+    def getbuffer_indices(self, indices):
+        """Pack an (h, w) array of 4-bit color indices, landscape or portrait, into a frame buffer."""
+        imheight, imwidth = indices.shape
         if (imwidth == self.width and imheight == self.height):
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    Add = int((x + y * self.width) / 2)
-                    Color = 0
-                    if (pixels[x, y][0] == 0 and pixels[x, y][1] == 0 and pixels[x, y][2] == 0):
-                        Color = 0
-                    elif (pixels[x, y][0] == 255 and pixels[x, y][1] == 255 and pixels[x, y][2] == 255):
-                        Color = 1
-                    elif (pixels[x, y][0] == 0 and pixels[x, y][1] == 255 and pixels[x, y][2] == 0):
-                        Color = 2
-                    elif (pixels[x, y][0] == 0 and pixels[x, y][1] == 0 and pixels[x, y][2] == 255):
-                        Color = 3
-                    elif (pixels[x, y][0] == 255 and pixels[x, y][1] == 0 and pixels[x, y][2] == 0):
-                        Color = 4
-                    elif (pixels[x, y][0] == 255 and pixels[x, y][1] == 255 and pixels[x, y][2] == 0):
-                        Color = 5
-                    elif (pixels[x, y][0] == 255 and pixels[x, y][1] == 128 and pixels[x, y][2] == 0):
-                        Color = 6
-                    data_t = buf[Add] & (~(0xF0 >> ((x % 2) * 4)))
-                    buf[Add] = data_t | ((Color << 4) >> ((x % 2) * 4))
+            return pack_indices(indices)
         elif (imwidth == self.height and imheight == self.width):
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    Add = int((newx + newy * self.width) / 2)
-                    Color = 0
-                    if (pixels[x, y][0] == 0 and pixels[x, y][1] == 0 and pixels[x, y][2] == 0):
-                        Color = 0
-                    elif (pixels[x, y][0] == 255 and pixels[x, y][1] == 255 and pixels[x, y][2] == 255):
-                        Color = 1
-                    elif (pixels[x, y][0] == 0 and pixels[x, y][1] == 255 and pixels[x, y][2] == 0):
-                        Color = 2
-                    elif (pixels[x, y][0] == 0 and pixels[x, y][1] == 0 and pixels[x, y][2] == 255):
-                        Color = 3
-                    elif (pixels[x, y][0] == 255 and pixels[x, y][1] == 0 and pixels[x, y][2] == 0):
-                        Color = 4
-                    elif (pixels[x, y][0] == 255 and pixels[x, y][1] == 255 and pixels[x, y][2] == 0):
-                        Color = 5
-                    elif (pixels[x, y][0] == 255 and pixels[x, y][1] == 128 and pixels[x, y][2] == 0):
-                        Color = 6
-                    data_t = buf[Add] & (~(0xF0 >> ((newx % 2) * 4)))
-                    buf[Add] = data_t | ((Color << 4) >> ((newx % 2) * 4))
-        return buf
+            # portrait: pixel (x, y) lands on (y, height - x - 1) of the panel
+            return pack_indices(np.rot90(indices))
+        return bytearray(int(self.width * self.height / 2))
 
     def display(self, image):
         self.send_command(0x61)  # Set Resolution setting
@@ -210,7 +180,7 @@ class EPD:
         self.send_data(0x01)
         self.send_data(0x90)
         self.send_command(0x10)
-        self.send_data2([0x11] * int(EPD_HEIGHT) * int(EPD_WIDTH / 2))
+        self.send_data2(CLEAR_FRAME)
         # BLACK   0x00    /// 0000
         # WHITE   0x11    /// 0001
         # GREEN   0x22    /// 0010
@@ -227,9 +197,16 @@ class EPD:
         self.ReadBusyLow()
         # epdconfig.delay_ms(500)
 
-    def sleep(self):
+    def sleep(self, module_exit=True):
         # epdconfig.delay_ms(500)
         self.send_command(0x07)  # DEEP_SLEEP
         self.send_data(0XA5)
         epdconfig.delay_ms(2000)
+        if module_exit:
+            epdconfig.module_exit()
+
+    def module_init(self):
+        return epdconfig.module_init()
+
+    def module_exit(self):
         epdconfig.module_exit()
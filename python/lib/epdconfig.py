@@ -40,6 +40,31 @@ import time
 
 logger = logging.getLogger()
 
+SPIDEV_BUFSIZ_PATH = Path('/sys/module/spidev/parameters/bufsiz')
+
+
+def spidev_bufsiz():
+    # largest single transfer the spidev kernel driver accepts, 4096 unless changed via modprobe
+    try:
+        return int(SPIDEV_BUFSIZ_PATH.read_text())
+    except (OSError, ValueError):
+        return 4096
+
+
+def byte_view(data):
+    # bytes, bytearray, memoryview, mmap and numpy arrays are used in place, only lists get copied
+    try:
+        return memoryview(data).cast('B')
+    except TypeError:
+        return memoryview(bytes(data))
+
+
+def spidev_write_chunked(spi, data, chunk_size):
+    view = byte_view(data)
+    for start in range(0, len(view), chunk_size):
+        # slicing a memoryview does not copy
+        spi.writebytes2(view[start:start + chunk_size])
+
 
 class RaspberryPi:
     # Pin definition
@@ -54,6 +79,7 @@ class RaspberryPi:
         import RPi.GPIO
         self.GPIO = RPi.GPIO
         self.SPI = spidev.SpiDev()
+        self.spi_chunk_size = spidev_bufsiz()
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -68,7 +94,7 @@ class RaspberryPi:
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
-        self.SPI.writebytes2(data)
+        spidev_write_chunked(self.SPI, data, self.spi_chunk_size)
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -119,6 +145,9 @@ class JetsonNano:
                 break
         if self.SPI is None:
             raise RuntimeError('Cannot find sysfs_software_spi.so')
+        # declared once so ctypes does not have to guess the argument conversion on every byte
+        self.SPI.SYSFS_software_spi_transfer.argtypes = [ctypes.c_uint8]
+        self.SPI.SYSFS_software_spi_transfer.restype = ctypes.c_uint8
         import Jetson.GPIO
         self.GPIO = Jetson.GPIO
 
@@ -135,8 +164,10 @@ class JetsonNano:
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
     def spi_writebyte2(self, data):
-        for i in range(len(data)):
-            self.SPI.SYSFS_software_spi_transfer(data[i])
+        # single bulk entry point, sysfs_software_spi.so only exports a per-byte transfer
+        transfer = self.SPI.SYSFS_software_spi_transfer
+        for value in byte_view(data):
+            transfer(value)
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -174,6 +205,7 @@ class SunriseX3:
         import Hobot.GPIO
         self.GPIO = Hobot.GPIO
         self.SPI = spidev.SpiDev()
+        self.spi_chunk_size = spidev_bufsiz()
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -190,7 +222,7 @@ class SunriseX3:
     def spi_writebyte2(self, data):
         # for i in range(len(data)):
         #     self.SPI.writebytes([data[i]])
-        self.SPI.xfer3(data)
+        spidev_write_chunked(self.SPI, data, self.spi_chunk_size)
 
     def module_init(self):
         if self.Flag == 0:
@@ -0,0 +1,134 @@
+import logging
+from collections import Counter, deque
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PASSED = 'passed'
+SILENT = 'silent'
+NOISE = 'noise'
+
+
+class AudioGate:
+    """Cheap pre-check on a raw (not yet normalized) window before YAMNet runs.
+
+    Works on 1024-sample frames: RMS level against an adaptive noise floor catches a quiet
+    room, high spectral flatness together with a high zero-crossing rate catches steady
+    broadband noise (fans, HVAC, hiss). Anything else is passed on to the model.
+
+    The floor starts at `silence_dbfs`. A louder room level is only adopted once `learn`
+    reported `floor_windows` windows in a row that the model found not to be music, at levels
+    within `floor_margin_db` of each other, so starting in the middle of a song cannot teach
+    the gate that the song is silence.
+    """
+
+    def __init__(self, frame_size=1024, silence_dbfs=-60.0, floor_margin_db=6.0, floor_ceiling_dbfs=-40.0,
+                 floor_rise=0.05, floor_windows=3, flatness_threshold=0.5, zcr_threshold=0.25):
+        self.frame_size = frame_size
+        self.silence_dbfs = silence_dbfs
+        # the floor only marks windows below this level as silent, however loud the room gets
+        self.floor_ceiling_dbfs = floor_ceiling_dbfs
+        self.floor_margin_db = floor_margin_db
+        self.floor_rise = floor_rise
+        self.floor_windows = floor_windows
+        self.flatness_threshold = flatness_threshold
+        self.zcr_threshold = zcr_threshold
+        self.noise_floor_db = silence_dbfs
+        # levels of the last passed windows the model classified as not music
+        self._quiet_levels = []
+        self.counters = Counter({PASSED: 0, SILENT: 0, NOISE: 0})
+        self.last_features = None
+        self._window = np.hanning(frame_size)
+        # (absolute start sample, features) of the frames inside the latest streamed window, oldest first
+        self._frames = deque()
+        self._next_frame_start = 0
+
+    def frame_features(self, frames):
+        """RMS, spectral flatness and zero-crossing rate of each row of `frames`, as an (n, 3) array."""
+        rms = np.sqrt(np.mean(np.square(frames), axis=1))
+        power = np.square(np.abs(np.fft.rfft(frames * self._window, axis=1))) + 1e-12
+        flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+        zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+        return np.stack((rms, flatness, zcr), axis=1)
+
+    def features(self, samples):
+        """Median frame RMS in dBFS, spectral flatness and zero-crossing rate of a window."""
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+        n_frames = max(1, len(samples) // self.frame_size)
+        frames = np.resize(samples, n_frames * self.frame_size).reshape(n_frames, self.frame_size)
+        return self._summarize(self.frame_features(frames))
+
+    @staticmethod
+    def _summarize(features):
+        rms, flatness, zcr = np.median(features, axis=0)
+        return float(20 * np.log10(rms + 1e-10)), float(flatness), float(zcr)
+
+    def pending_start(self, window_start):
+        """First stream position `update` still needs samples from for a window starting at `window_start`."""
+        return max(self._next_frame_start, -(-window_start // self.frame_size) * self.frame_size)
+
+    def update(self, samples, window_end, window_length):
+        """Incremental `check` for overlapping windows of a stream.
+
+        `samples` end at stream position `window_end` and start at or before `pending_start`.
+        Frames sit on a fixed grid of the stream, only those not seen by an earlier window are
+        analyzed, the decision is taken over the cached features of the `window_length` window.
+        """
+        window_start = window_end - window_length
+        while self._frames and self._frames[0][0] < window_start:
+            self._frames.popleft()
+        start = self.pending_start(max(window_start, window_end - len(samples)))
+        n_frames = (window_end - start) // self.frame_size
+        if n_frames > 0:
+            offset = start - (window_end - len(samples))
+            frames = np.asarray(samples[offset:offset + n_frames * self.frame_size], dtype=np.float32)
+            features = self.frame_features(frames.reshape(n_frames, self.frame_size))
+            self._frames.extend(zip(range(start, start + n_frames * self.frame_size, self.frame_size), features))
+            self._next_frame_start = start + n_frames * self.frame_size
+        if not self._frames:
+            return self.check(samples)
+        return self._decide(self._summarize(np.stack([features for _, features in self._frames])))
+
+    def check(self, samples):
+        """Returns PASSED, SILENT or NOISE and updates the counters and the noise floor."""
+        return self._decide(self.features(samples))
+
+    def _decide(self, features):
+        level_db, flatness, zcr = features
+        self.last_features = (level_db, flatness, zcr)
+        if level_db < self.noise_floor_db:
+            self.noise_floor_db = level_db
+        near_floor = level_db < min(self.noise_floor_db + self.floor_margin_db, self.floor_ceiling_dbfs)
+        if level_db < self.silence_dbfs or near_floor:
+            decision = SILENT
+        elif flatness > self.flatness_threshold and zcr > self.zcr_threshold:
+            decision = NOISE
+        else:
+            decision = PASSED
+        if decision != PASSED:
+            # only quiet or noisy windows move the floor up, so a long song does not raise it
+            self.noise_floor_db += self.floor_rise * (level_db - self.noise_floor_db)
+        self.counters[decision] += 1
+        return decision
+
+    def learn(self, is_music):
+        """Feeds the model's decision on the last passed window, stable non-music levels become the floor."""
+        if is_music or self.last_features is None:
+            self._quiet_levels.clear()
+            return
+        self._quiet_levels = (self._quiet_levels + [self.last_features[0]])[-self.floor_windows:]
+        if (len(self._quiet_levels) == self.floor_windows
+                and max(self._quiet_levels) - min(self._quiet_levels) <= self.floor_margin_db):
+            self.noise_floor_db = max(self.noise_floor_db, min(float(np.mean(self._quiet_levels)),
+                                                               self.floor_ceiling_dbfs))
+
+    def should_run_model(self, samples, window_end=None, window_length=None):
+        """`check`, or `update` when the stream position of the window is given."""
+        decision = self.check(samples) if window_end is None else self.update(samples, window_end, window_length)
+        if decision != PASSED:
+            level_db, flatness, zcr = self.last_features
+            logger.debug(f'Audio gate: {decision} (level {level_db:.1f} dBFS, floor {self.noise_floor_db:.1f} dBFS, '
+                         f'flatness {flatness:.2f}, zcr {zcr:.2f}), counters {dict(self.counters)}')
+        return decision == PASSED
@@ -1,15 +1,96 @@
-import io
 import logging
+import struct
+import threading
 
 import numpy as np
 import sounddevice as sd
-import scipy.io.wavfile as wav
 
-from scipy.signal import resample
+from service.resampler import PolyphaseResampler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# RIFF/WAVE header of a 16 bit PCM file: chunk ids, sizes, format, channels, rates, block align, bit depth
+_WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+
+
+class AudioRingBuffer:
+    """Preallocated mono float32 ring buffer, written by the capture callback and read by
+    any number of consumers. Positions are absolute sample counts since the stream started.
+
+    The peak of every `peak_block` samples is kept as they are written, so the peak of a
+    window costs one value per block instead of a pass over the window.
+    """
+
+    def __init__(self, capacity, peak_block=1024):
+        self.capacity = capacity
+        self.peak_block = peak_block
+        self._buffer = np.zeros(capacity, dtype=np.float32)
+        # block number % len -> peak of that block, with room for the partial blocks at both ends
+        self._peaks = np.zeros(-(-capacity // peak_block) + 2, dtype=np.float32)
+        self._written = 0
+        self._condition = threading.Condition()
+
+    @property
+    def written(self):
+        return self._written
+
+    def write(self, samples):
+        samples = samples[-self.capacity:]
+        n = len(samples)
+        with self._condition:
+            start = self._written % self.capacity
+            first = min(n, self.capacity - start)
+            self._buffer[start:start + first] = samples[:first]
+            self._buffer[:n - first] = samples[first:]
+            position = self._written
+            while position < self._written + n:
+                block = position // self.peak_block
+                block_end = min((block + 1) * self.peak_block, self._written + n)
+                peak = np.max(np.abs(samples[position - self._written:block_end - self._written]))
+                slot = block % len(self._peaks)
+                # a block written over several calls keeps the peak of its earlier part
+                self._peaks[slot] = peak if position % self.peak_block == 0 else max(self._peaks[slot], peak)
+                position = block_end
+            self._written += n
+            self._condition.notify_all()
+
+    def wait_until(self, position, timeout=None):
+        """Blocks until `position` samples have been written, returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._written >= position, timeout)
+
+    def read(self, end, length):
+        """Copies the `length` samples ending at absolute position `end`."""
+        with self._condition:
+            self._check(end, length)
+            return self._copy(end, length)
+
+    def peak(self, end, length):
+        """Largest absolute sample of the `length` samples ending at `end`, from the block peaks
+        plus the partial blocks at both edges.
+        """
+        with self._condition:
+            self._check(end, length)
+            start = end - length
+            first_block, last_block = -(-start // self.peak_block), end // self.peak_block
+            if first_block >= last_block:
+                return float(np.max(np.abs(self._copy(end, length)), initial=0.0))
+            blocks = np.arange(first_block, last_block) % len(self._peaks)
+            head = self._copy(first_block * self.peak_block, first_block * self.peak_block - start)
+            tail = self._copy(end, end - last_block * self.peak_block)
+            return float(max(self._peaks[blocks].max(), np.max(np.abs(head), initial=0.0),
+                             np.max(np.abs(tail), initial=0.0)))
+
+    def _check(self, end, length):
+        if length > self.capacity or end > self._written or end - length < self._written - self.capacity:
+            raise ValueError(f'Samples {end - length}..{end} are not in the ring buffer')
+
+    def _copy(self, end, length):
+        start = (end - length) % self.capacity
+        first = min(length, self.capacity - start)
+        return np.concatenate((self._buffer[start:start + first], self._buffer[:length - first]))
+
 
 class AudioService:
     def __init__(self):
@@ -17,6 +98,12 @@ class AudioService:
         self.down_sampled_rate = 16000  # sample rate supported by ML model and Shazam API
         self.raw_recording_sample_rate = 44100  # only supported rate by raspberry pi zero
         self.gain = 3.0  # you can adjust this if needed
+        # 44.1 kHz -> 16 kHz is 160/441, one resampler for one-shot recordings, one carrying stream state
+        self.resampler = PolyphaseResampler(self.raw_recording_sample_rate, self.down_sampled_rate)
+        self._stream_resampler = PolyphaseResampler(self.raw_recording_sample_rate, self.down_sampled_rate)
+        self.stream = None
+        self.ring_buffer = None
+        self._window_end = 0
         device_index = self.find_device_idx_by_name()
 
         if device_index is not None:
@@ -34,20 +121,80 @@ class AudioService:
     def is_mic_connected(self):
         return self.find_device_idx_by_name() is not None
 
-    def record_raw_audio(self, recording_duration):
+    def record_raw_audio(self, recording_duration, normalize=True):
+        """Records `recording_duration` seconds at 16 kHz. With `normalize=False` the capture level is
+        kept, e.g. for `AudioGate`, and `normalize` can be applied afterwards.
+        """
         audio = sd.rec(int(recording_duration * self.raw_recording_sample_rate),
                        samplerate=self.raw_recording_sample_rate, channels=1, dtype=np.float32)
         sd.wait()
-        num_samples = int(len(audio) * self.down_sampled_rate / self.raw_recording_sample_rate)
-        resampled_audio = resample(audio, num_samples)
-        max_val = np.max(np.abs(resampled_audio))
+        resampled_audio = self.resampler.resample(audio[:, 0])
+        return self.normalize(resampled_audio) if normalize else resampled_audio
+
+    def start_stream(self, buffer_duration=30):
+        """Starts continuous capture into a ring buffer holding the last `buffer_duration` seconds,
+        resampled to 16 kHz as it arrives.
+        """
+        if self.stream is not None:
+            return
+        self.ring_buffer = AudioRingBuffer(int(buffer_duration * self.down_sampled_rate))
+        self._stream_resampler.reset()
+        self._window_end = 0
+        self.stream = sd.InputStream(samplerate=self.raw_recording_sample_rate, channels=1, dtype=np.float32,
+                                     callback=self._on_audio)
+        self.stream.start()
+
+    def stop_stream(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def _on_audio(self, indata, frames, time_info, status):
+        if status.input_overflow:
+            logger.warning('Audio input overflow, samples were lost')
+        self.ring_buffer.write(self._stream_resampler.process(indata[:, 0]))
+
+    def next_window(self, duration, hop=None, normalize=True):
+        """Blocks until `hop` (default `duration`) seconds of audio arrived after the previous
+        window, then returns the latest `duration` seconds. A consumer that falls behind
+        gets the most recent audio instead of a backlog.
+        """
+        window = self.ring_buffer.read(self.next_window_end(duration, hop), int(duration * self.down_sampled_rate))
+        return self.normalize(window) if normalize else window
+
+    def next_window_end(self, duration, hop=None):
+        """Waits like `next_window` but only returns the window's end position, so the window can be
+        read from `ring_buffer` later by another thread without copying it through a queue.
+        """
+        hop_samples = int((duration if hop is None else hop) * self.down_sampled_rate)
+        length = int(duration * self.down_sampled_rate)
+        self.ring_buffer.wait_until(max(self._window_end + hop_samples, length))
+        self._window_end = self.ring_buffer.written
+        return self._window_end
+
+    def normalize(self, resampled_audio, peak=None):
+        """Scales to the peak, of `resampled_audio` itself unless the peak of a larger window is
+        given, and applies the gain.
+        """
+        max_val = np.max(np.abs(resampled_audio)) if peak is None else peak
         if max_val > 0:
             resampled_audio = resampled_audio / max_val
         resampled_audio = np.clip(resampled_audio * self.gain, -1.0, 1.0)
         return np.squeeze(resampled_audio)
 
-    def convert_audio_to_wav_format(self, raw_audio):
-        audio_buffer = io.BytesIO()
-        wav.write(audio_buffer, self.down_sampled_rate, raw_audio)
-        audio_buffer.seek(0)
-        return audio_buffer
+    def encode_pcm16(self, raw_audio):
+        """Converts the normalized float window once into 16 kHz mono int16 PCM for Shazam.
+
+        shazamio's signature generator only takes a container, so the PCM is written right
+        behind a 44 byte WAV header in the same buffer, which is half the size of the float32 WAV.
+        """
+        samples = np.asarray(raw_audio, dtype=np.float32)
+        data_size = 2 * len(samples)
+        payload = bytearray(_WAV_HEADER.size + data_size)
+        _WAV_HEADER.pack_into(payload, 0, b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, 1,
+                              self.down_sampled_rate, 2 * self.down_sampled_rate, 2, 16, b'data', data_size)
+        pcm = np.frombuffer(payload, dtype='<i2', offset=_WAV_HEADER.size)
+        # samples are already clipped to [-1, 1]
+        np.rint(samples * 32767, out=pcm, casting='unsafe')
+        return payload
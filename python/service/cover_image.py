@@ -0,0 +1,41 @@
+import logging
+import math
+import time
+
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def draft_size(size, panel_size, small_cover_px=0):
+    """Smallest size of an image of `size` that still covers `panel_size` once scaled to fill it
+    (what ImageOps.fit does) and still gives a `small_cover_px` square cover without upscaling.
+    """
+    width, height = size
+    scale = max(panel_size[0] / width, panel_size[1] / height)
+    return max(math.ceil(width * scale), small_cover_px), max(math.ceil(height * scale), small_cover_px)
+
+
+def open_cover(source, panel_size=None, small_cover_px=0):
+    """Opens and decodes a cover image (path or file object).
+
+    With `panel_size` a JPEG is decoded in draft mode, i.e. scaled by 1/2, 1/4 or 1/8 inside the
+    decoder, to the smallest scale that still covers `draft_size`. The background and the small
+    cover are both derived from this one decoded image. Logs the decode time and the size of the
+    decoded pixel buffer, width x height x bands. That is computed, not a measured peak: Pillow
+    allocates pixels with plain malloc, outside of what tracemalloc sees.
+    """
+    started = time.perf_counter()
+    image = Image.open(source)
+    full_size = image.size
+    if panel_size is not None and image.format == 'JPEG':
+        image.draft(image.mode, draft_size(full_size, panel_size, small_cover_px))
+    image.load()
+    decode_ms = (time.perf_counter() - started) * 1000
+    bands = len(image.getbands())
+    buffer_bytes = image.width * image.height * bands
+    full_buffer_bytes = full_size[0] * full_size[1] * bands
+    logger.info(f'Cover {full_size[0]}x{full_size[1]} decoded at {image.width}x{image.height} in {decode_ms:.0f} ms, '
+                f'pixel buffer {buffer_bytes / 2 ** 20:.2f} MiB (at full size {full_buffer_bytes / 2 ** 20:.2f} MiB)')
+    return image
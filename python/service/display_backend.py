@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from service.quantizer import ACEP_PALETTE_RGB, FLOYD_STEINBERG, Quantizer, pack_indices, unpack_indices
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def blend_palette(saturated, desaturated, saturation, colors=7):
+    """Flat RGB palette blending inky's measured (`saturated`) and ideal (`desaturated`) colors,
+    the same blend as the driver's own set_image path.
+    """
+    palette = []
+    for saturated_rgb, desaturated_rgb in list(zip(saturated, desaturated))[:colors]:
+        palette += [int(s * saturation + d * (1.0 - saturation)) for s, d in zip(saturated_rgb, desaturated_rgb)]
+    return palette
+
+
+class DisplayBackend:
+    """Owns one long-lived panel driver.
+
+    A refresh is `pack` (image -> frame buffer, no hardware access), then `wake`, `show`
+    and `sleep`. `pack` is kept separate so callers can inspect the frame before
+    paying for a refresh. Both panels quantize through the same `Quantizer`, only
+    their palettes differ.
+    """
+    model = None
+
+    def __init__(self, saturation: float, dither: str = FLOYD_STEINBERG):
+        self.saturation = saturation
+        self.dither = dither
+        self.awake = False
+
+    @classmethod
+    def from_profile(cls, profile) -> DisplayBackend:
+        return cls(dither=profile.dither_mode)
+
+    def wake(self):
+        self.awake = True
+
+    def sleep(self):
+        self.awake = False
+
+    def close(self):
+        """Releases the driver's hardware, the backend is not used afterwards."""
+
+    def pack(self, image: Image):
+        raise NotImplementedError
+
+    def show(self, frame):
+        raise NotImplementedError
+
+    def frame_from_buffer(self, buffer):
+        """Turns raw frame bytes (e.g. from the frame cache) back into what `show` expects."""
+        return buffer
+
+    def clean(self):
+        raise NotImplementedError
+
+
+class InkyBackend(DisplayBackend):
+    model = 'inky'
+
+    def __init__(self, saturation: float = 0.5, dither: str = FLOYD_STEINBERG):
+        super().__init__(saturation, dither)
+        from inky.auto import auto
+        from inky.inky_uc8159 import CLEAN
+        # EEPROM auto-detection and GPIO/SPI setup happen once for the whole service lifetime
+        self._inky = auto()
+        self._clean_colour = CLEAN
+        try:
+            saturated, desaturated = self._inky.SATURATED_PALETTE, self._inky.DESATURATED_PALETTE
+        except AttributeError:
+            raise RuntimeError(f'{type(self._inky).__module__} has no SATURATED_PALETTE / DESATURATED_PALETTE, '
+                               f'this version of the inky library is not supported') from None
+        # blend the measured and ideal palettes by saturation, the trailing CLEAN entry is not a drawing color
+        self.quantizer = Quantizer(blend_palette(saturated, desaturated, saturation), dither=dither)
+        logger.info('Loading Pimoroni inky lib')
+
+    def pack(self, image: Image):
+        if image.size != (self._inky.width, self._inky.height):
+            raise ValueError(f'Image must be ({self._inky.width}x{self._inky.height}) pixels!')
+        # the driver's buffer is an (h, w) array of palette indices, which is exactly what we produce
+        return self.quantizer.quantize(image)
+
+    def show(self, frame):
+        self._inky.buf = frame
+        self._inky.show()
+
+    def frame_from_buffer(self, buffer):
+        return np.frombuffer(buffer, dtype=np.uint8).reshape((self._inky.height, self._inky.width))
+
+    def clean(self):
+        for _ in range(2):
+            self._inky.buf = np.full((self._inky.height, self._inky.width), self._clean_colour, dtype=np.uint8)
+            self._inky.show()
+            time.sleep(1.0)
+
+
+class Waveshare4Backend(DisplayBackend):
+    model = 'waveshare4'
+
+    def __init__(self, saturation: float = 2, dither: str = FLOYD_STEINBERG):
+        super().__init__(saturation, dither)
+        from lib import epd4in01f
+        self._epd = epd4in01f.EPD()
+        # GPIO and SPI are opened once, wake and sleep only reset the panel and send it to deep sleep
+        if self._epd.module_init() != 0:
+            raise RuntimeError('Could not set up GPIO and SPI for the Waveshare panel')
+        # the panel is driven with ideal colors, saturation is applied to the image instead
+        self.quantizer = Quantizer(epd4in01f.PALETTE_RGB, dither=dither, color_boost=saturation)
+        logger.info('Loading Waveshare 4" lib')
+
+    def wake(self):
+        # the panel needs a hardware reset to leave deep sleep, skip it if we are still awake
+        if not self.awake:
+            self._epd.init(module_init=False)
+            super().wake()
+
+    def sleep(self):
+        if self.awake:
+            self._epd.sleep(module_exit=False)
+            super().sleep()
+
+    def close(self):
+        self.sleep()
+        # powers the module down and releases the pins
+        self._epd.module_exit()
+
+    def pack(self, image: Image):
+        return self._epd.getbuffer_indices(self.quantizer.quantize(image))
+
+    def show(self, frame):
+        self._epd.display(frame)
+
+    def clean(self):
+        self._epd.Clear()
+
+
+class VirtualBackend(DisplayBackend):
+    """Headless stand-in for a 7-color ACeP panel.
+
+    Takes the same 4-bit packed frames as the Waveshare driver, writes each refresh as a
+    PNG and a raw dump, blocks for as long as the real BUSY pin would, and appends the
+    timing of every refresh to `timings.jsonl` in the output directory.
+    """
+    model = 'virtual'
+    PALETTE_RGB = ACEP_PALETTE_RGB
+    WHITE = 1
+    # hardware reset on wake: 200 ms high, 1 ms low, 200 ms high
+    RESET_SECONDS = 0.401
+
+    def __init__(self, width: int, height: int, output_dir: str, refresh_seconds: float = 30.0,
+                 keep_frames: int = 100, saturation: float = 2, dither: str = FLOYD_STEINBERG):
+        super().__init__(saturation, dither)
+        self.width = width
+        self.height = height
+        self.output_dir = output_dir
+        self.refresh_seconds = refresh_seconds
+        self.keep_frames = keep_frames
+        self.quantizer = Quantizer(self.PALETTE_RGB, dither=dither, color_boost=saturation)
+        self.refresh_count = 0
+        self.timings = []
+        self._last_pack_seconds = None
+        os.makedirs(self.output_dir, exist_ok=True)
+        logger.info(f'Using virtual {width}x{height} panel, frames go to {output_dir}')
+
+    @classmethod
+    def from_profile(cls, profile) -> VirtualBackend:
+        return cls(profile.width, profile.height, profile.virtual_output_dir,
+                   refresh_seconds=profile.virtual_refresh_seconds, dither=profile.dither_mode)
+
+    def wake(self):
+        if not self.awake:
+            time.sleep(self.RESET_SECONDS)
+            super().wake()
+
+    def pack(self, image: Image):
+        start = time.monotonic()
+        indices = self.quantizer.quantize(image)
+        if indices.shape != (self.height, self.width):
+            raise ValueError(f'Image must be ({self.width}x{self.height}) pixels!')
+        frame = pack_indices(indices)
+        self._last_pack_seconds = time.monotonic() - start
+        return frame
+
+    def show(self, frame):
+        self._refresh('display', frame)
+
+    def clean(self):
+        self._refresh('clean', bytes([self.WHITE << 4 | self.WHITE]) * (self.width * self.height // 2))
+
+    def _refresh(self, kind, frame):
+        if not self.awake:
+            raise RuntimeError('Virtual panel is asleep, call wake() first')
+        start = time.monotonic()
+        indices = unpack_indices(frame, self.width, self.height)
+        self.refresh_count += 1
+        name = os.path.join(self.output_dir, f'frame_{self.refresh_count:05d}')
+        Image.fromarray(np.asarray(self.PALETTE_RGB, dtype=np.uint8)[indices]).save(f'{name}.png')
+        with open(f'{name}.raw', 'wb') as raw_file:
+            raw_file.write(frame)
+        transfer_seconds = time.monotonic() - start
+        # BUSY stays high for the whole refresh
+        time.sleep(self.refresh_seconds)
+        timing = {'refresh': self.refresh_count, 'kind': kind,
+                  'pack_s': self._last_pack_seconds if kind == 'display' else None,
+                  'transfer_s': round(transfer_seconds, 4),
+                  'busy_s': self.refresh_seconds,
+                  'total_s': round(time.monotonic() - start, 4)}
+        self._last_pack_seconds = None
+        self.timings.append(timing)
+        with open(os.path.join(self.output_dir, 'timings.jsonl'), 'a') as timings_file:
+            timings_file.write(json.dumps(timing) + '\n')
+        self._prune()
+
+    def _prune(self):
+        stale = self.refresh_count - self.keep_frames
+        for suffix in ('png', 'raw'):
+            path = os.path.join(self.output_dir, f'frame_{stale:05d}.{suffix}')
+            if stale > 0 and os.path.exists(path):
+                os.remove(path)
+
+
+DISPLAY_BACKENDS = {backend.model: backend for backend in (InkyBackend, Waveshare4Backend, VirtualBackend)}
+
+
+def create_display_backend(profile) -> DisplayBackend:
+    try:
+        backend_cls = DISPLAY_BACKENDS[profile.model]
+    except KeyError:
+        raise ValueError(f'Unsupported display model: {profile.model}') from None
+    return backend_cls.from_profile(profile)
@@ -0,0 +1,56 @@
+import logging
+import threading
+import time
+import traceback
+
+from service.pipeline import StageMetrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DisplayWorker:
+    """Runs rendering and panel I/O on a dedicated thread.
+
+    There is a single pending slot: submitting while the panel is busy replaces any job
+    that has not started yet (latest wins), so a stale song is never drawn after a newer one.
+    """
+
+    def __init__(self, name='display-worker'):
+        self._condition = threading.Condition()
+        self._pending = None
+        self.busy = False
+        self.dropped = 0
+        self.metrics = StageMetrics('render')
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, job):
+        """Queues `job` (a callable without arguments), replacing a job that has not started yet."""
+        with self._condition:
+            if self._pending is not None:
+                self.dropped += 1
+                self.metrics.dropped += 1
+                logger.info(f'Display busy, replacing pending frame ({self.dropped} dropped so far)')
+            self._pending = (time.perf_counter(), job)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                (queued_at, job), self._pending = self._pending, None
+                self.busy = True
+            started = time.perf_counter()
+            try:
+                job()
+                finished = time.perf_counter()
+                self.metrics.record(started - queued_at, finished - started, finished - queued_at)
+            except Exception as e:
+                self.metrics.errors += 1
+                logger.error(f'Display worker error: {e}')
+                logger.error(traceback.format_exc())
+            finally:
+                with self._condition:
+                    self.busy = False
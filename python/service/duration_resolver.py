@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MUSICBRAINZ_ISRC_URL = 'https://musicbrainz.org/ws/2/isrc/{isrc}'
+# MusicBrainz asks every client to identify itself
+USER_AGENT = 'shazampi-eink/1.0 ( https://github.com/ravi72munde/shazampi-eink )'
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average with bursts of up to `capacity`, thread safe."""
+
+    def __init__(self, rate=1.0, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Takes a token, waiting for one if needed. Returns False if none comes within `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class DurationResolver:
+    """Looks up track durations by ISRC on MusicBrainz.
+
+    Answers are cached in a JSON file, durations for `ttl` seconds and ISRCs MusicBrainz
+    does not know (or knows without a length) for `negative_ttl`, so a repeat track costs
+    no request. Network errors are not cached. Requests share one session with connect and
+    read timeouts and are limited to MusicBrainz's 1 request per second.
+    """
+
+    def __init__(self, cache_path=None, ttl=30 * 24 * 3600, negative_ttl=24 * 3600, rate=1.0,
+                 timeout=(3.05, 10), max_wait=5.0):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.rate_limiter = TokenBucket(rate)
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT, 'Accept': 'application/json'})
+        self.hits = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        # isrc -> [duration in seconds or None, fetched at (unix time)]
+        self._cache = {}
+        if cache_path is not None:
+            try:
+                with open(cache_path) as cache_file:
+                    self._cache = json.load(cache_file)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as ex:
+                logger.warning(f'Could not read duration cache {cache_path}: {ex}')
+
+    def resolve(self, isrc):
+        """Returns the duration in seconds, or None if unknown or MusicBrainz could not be reached."""
+        if not isrc or not isinstance(isrc, str):
+            return None
+        with self._lock:
+            cached = self._cache.get(isrc)
+        if cached is not None:
+            duration, fetched_at = cached
+            if time.time() - fetched_at < (self.ttl if duration is not None else self.negative_ttl):
+                self.hits += 1
+                return duration
+        if not self.rate_limiter.acquire(self.max_wait):
+            logger.info(f'MusicBrainz rate limit reached, no duration for {isrc}')
+            return None
+        try:
+            self.requests += 1
+            response = self.session.get(MUSICBRAINZ_ISRC_URL.format(isrc=isrc), params={'fmt': 'json'},
+                                        timeout=self.timeout)
+            if response.status_code == 404:
+                duration = None
+            else:
+                response.raise_for_status()
+                lengths = [recording['length'] for recording in response.json().get('recordings', [])
+                           if recording.get('length')]
+                duration = lengths[0] / 1000 if lengths else None
+        except (requests.exceptions.RequestException, ValueError) as ex:
+            logger.error(f'MusicBrainz lookup for {isrc} failed: {ex}')
+            return None
+        with self._lock:
+            now = time.time()
+            self._cache = {key: entry for key, entry in self._cache.items() if now - entry[1] < self.ttl}
+            self._cache[isrc] = [duration, now]
+            self._persist()
+        return duration
+
+    def _persist(self):
+        if self.cache_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            tmp_path = f'{self.cache_path}.tmp'
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(self._cache, cache_file)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as ex:
+            logger.warning(f'Could not persist duration cache {self.cache_path}: {ex}')
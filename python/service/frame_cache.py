@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import mmap
+import os
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def frame_digest(frame_buffer):
+    """Stable digest of a packed panel frame buffer (bytes, bytearray or memoryview)."""
+    return hashlib.blake2b(frame_buffer, digest_size=16).hexdigest()
+
+
+class LastFrameStore:
+    """Remembers the digest of the frame currently on the glass, persisted across restarts."""
+
+    def __init__(self, path):
+        self.path = path
+        self.skipped = 0
+        self.last_digest = None
+        try:
+            with open(self.path) as state_file:
+                self.last_digest = state_file.read().strip() or None
+        except FileNotFoundError:
+            pass
+        except OSError as ex:
+            logger.warning(f'Could not read last frame state {self.path}: {ex}')
+
+    def is_on_display(self, digest):
+        """Returns True (and counts a skipped refresh) if `digest` is already shown."""
+        if digest is not None and digest == self.last_digest:
+            self.skipped += 1
+            return True
+        return False
+
+    def update(self, digest):
+        self.last_digest = digest
+        self._persist()
+
+    def clear(self):
+        self.update(None)
+
+    def _persist(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as state_file:
+                state_file.write(self.last_digest or '')
+            os.replace(tmp_path, self.path)
+        except OSError as ex:
+            logger.warning(f'Could not persist last frame state {self.path}: {ex}')
+
+
+class RenderedFrameCache:
+    """Bounded on-disk LRU cache of packed panel frames.
+
+    Frames are keyed by track identity, a hash of the render configuration and the panel
+    model, so any config change simply misses. Hits are memory-mapped instead of read
+    and bump the file's mtime, which is its LRU position.
+    """
+
+    def __init__(self, directory, max_bytes, config_hash, model):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.config_hash = config_hash
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, *track_identity):
+        key_source = '\0'.join(str(part) for part in (*track_identity, self.config_hash, self.model))
+        return hashlib.blake2b(key_source.encode(), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.frame')
+
+    def contains(self, key):
+        """Cheap existence check, does not count as a hit or move the entry."""
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """Returns a read-only memory map of the cached frame, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as frame_file:
+                frame = mmap.mmap(frame_file.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            # ValueError: empty file left behind by an interrupted write
+            self.misses += 1
+            logger.info(f'Frame cache miss ({self.hits} hits, {self.misses} misses)')
+            return None
+        self.hits += 1
+        logger.info(f'Frame cache hit ({self.hits} hits, {self.misses} misses)')
+        return frame
+
+    def put(self, key, frame_buffer):
+        path = self._path(key)
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'wb') as frame_file:
+                frame_file.write(frame_buffer)
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError as ex:
+            logger.warning(f'Could not cache frame {path}: {ex}')
+
+    def _evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.frame'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
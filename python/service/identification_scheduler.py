@@ -0,0 +1,114 @@
+import time
+
+
+class IdentificationScheduler:
+    """Decides when the playing song should be identified again, on a monotonic clock.
+
+    After a match the playback position is tracked from Shazam's offset and the next
+    identification is due `boundary_margin` seconds after the predicted end of the song, so
+    the next window already holds the next song. Without a duration it falls back to
+    `fallback_interval`. Misses back off exponentially from `retry_interval` up to
+    `max_retry_interval`. When the same song is still playing at a due time the next look is
+    `same_song_interval` later. An early call, e.g. on a detected song change, waits for
+    `min_interval` after the previous call. For comparison it counts the calls a fixed policy (identify when
+    music starts, then every `fallback_interval` seconds while it plays) would have made.
+    """
+
+    def __init__(self, recording_duration=10, fallback_interval=120, min_interval=10, boundary_margin=5,
+                 retry_interval=30, max_retry_interval=480, same_song_interval=30, idle_after=60,
+                 clock=time.monotonic):
+        self.recording_duration = recording_duration
+        self.fallback_interval = fallback_interval
+        self.min_interval = min_interval
+        self.boundary_margin = boundary_margin
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.same_song_interval = same_song_interval
+        self.idle_after = idle_after
+        self.clock = clock
+        self.calls = 0
+        self.misses_in_row = 0
+        self._fixed_calls = 0.0
+        self._next_due = clock()
+        self._last_music_at = clock()
+        self._last_call_at = None
+        self._last_observed = None
+        self._playing = False
+        # (clock time, playback position in seconds) of the last match, and the track's duration
+        self._anchor = None
+        self._duration = None
+
+    @property
+    def saved_calls(self):
+        """Shazam calls the fixed-interval policy would have made on top of ours."""
+        return int(self._fixed_calls) - self.calls
+
+    def observe(self, is_music_playing, now=None):
+        """Feeds every classified window, keeps the idle timer and the fixed-policy estimate."""
+        now = self.clock() if now is None else now
+        if is_music_playing:
+            if not self._playing:
+                self._fixed_calls += 1
+            elif self._last_observed is not None:
+                self._fixed_calls += (now - self._last_observed) / self.fallback_interval
+            self._last_music_at = now
+        self._playing = is_music_playing
+        self._last_observed = now
+
+    def is_due(self, now=None):
+        return (self.clock() if now is None else now) >= self._next_due
+
+    def seconds_until_due(self, now=None):
+        return max(0.0, self._next_due - (self.clock() if now is None else now))
+
+    def may_call_early(self, now=None):
+        """True once `min_interval` seconds passed since the last Shazam call, or before the first one."""
+        now = self.clock() if now is None else now
+        return self._last_call_at is None or now - self._last_call_at >= self.min_interval
+
+    def idle(self, now=None):
+        """True once no music was heard for `idle_after` seconds."""
+        return not self._playing and (self.clock() if now is None else now) - self._last_music_at >= self.idle_after
+
+    def position(self, now=None):
+        """Predicted playback position of the last matched song, None if unknown."""
+        if self._anchor is None:
+            return None
+        anchor_time, anchor_position = self._anchor
+        return anchor_position + (self.clock() if now is None else now) - anchor_time
+
+    def on_match(self, offset, duration, window_end=None, now=None):
+        """Schedules the next identification after the predicted song boundary.
+
+        `offset` is where in the song the identified window started, `window_end` the clock
+        time the window ended (defaults to now).
+        """
+        now = self.clock() if now is None else now
+        self.calls += 1
+        self._last_call_at = now
+        self.misses_in_row = 0
+        if not isinstance(offset, (int, float)):
+            self._anchor = self._duration = None
+            self._next_due = now + self.fallback_interval
+            return
+        window_end = now if window_end is None else window_end
+        self._anchor = (window_end, offset + self.recording_duration)
+        self._duration = duration if isinstance(duration, (int, float)) else None
+        if self._duration is None:
+            self._next_due = now + self.fallback_interval
+            return
+        remaining = self._duration - self.position(now)
+        self._next_due = now + max(self.min_interval, remaining + self.boundary_margin)
+
+    def on_miss(self, now=None):
+        """Backs off exponentially while identification keeps failing."""
+        now = self.clock() if now is None else now
+        self.calls += 1
+        self._last_call_at = now
+        self.misses_in_row += 1
+        self._anchor = self._duration = None
+        self._next_due = now + min(self.max_retry_interval, self.retry_interval * 2 ** (self.misses_in_row - 1))
+
+    def on_same_song(self, now=None):
+        """Pushes the next identification back by `same_song_interval` without a call."""
+        self._next_due = (self.clock() if now is None else now) + self.same_song_interval
@@ -2,49 +2,242 @@ import io
 import csv
 import logging
 import threading
+from collections import deque
+
+import numpy as np
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 cache_lock = threading.Lock()
 
+# YAMNet scores 0.96 s patches every 0.48 s, one patch needs 96 frames of 10 ms plus the 25 ms STFT window
+PATCH_SAMPLES = 15600
+PATCH_HOP_SAMPLES = 7680
+PATCH_HOP_SECONDS = PATCH_HOP_SAMPLES / 16000
+
+MODEL_PATH = 'python/ml-model/1.tflite'
+CLASS_MAP_PATH = 'python/ml-model/yamnet_class_map.csv'
+
+# YAMNet classes that mean music: singing, choir, chant, rapping (24-31) and Music with every
+# instrument, genre and mood below it in the AudioSet ontology (132-276), except the Bell subtree
+# (195-202: bell, church, jingle and bicycle bells, tuning fork, chimes) which fires on doorbells
+MUSIC_CLASS_INDICES = np.r_[24:32, 132:195, 203:277]
+
+
+def _dequantize(tensor, quantization):
+    scale, zero_point = quantization
+    return (tensor.astype(np.float32) - zero_point) * scale if scale else tensor
+
+
+def music_score(scores, class_indices=MUSIC_CLASS_INDICES):
+    """Mean over patches (rows of `scores`) of the strongest music class, any genre, instrument or singing counts."""
+    return float(scores[:, class_indices].max(axis=1).mean())
+
+
+class SongChangeDetector:
+    """Compares YAMNet embeddings of new windows with the window a song was identified from.
+
+    A cosine distance above `changed_distance` means the audio clearly changed, so the song
+    should be identified again right away. Below `same_distance` it is clearly still the
+    same song and a timed re-identification can be skipped, at most `max_skips` times in a
+    row so a similar sounding next track is still picked up.
+
+    The default distances are starting points, not yet measured on recorded songs, and a
+    distance between them leaves the decision to the timer. tests/test_music_detector.py
+    pins the behavior on both sides of each threshold.
+    """
+    CHANGED = 'changed'
+    SAME = 'same'
+    UNSURE = 'unsure'
+
+    def __init__(self, changed_distance=0.3, same_distance=0.1, max_skips=3):
+        self.changed_distance = changed_distance
+        self.same_distance = same_distance
+        self.max_skips = max_skips
+        self.reference = None
+        self.last_distance = None
+        self.skipped = 0
+        self.early = 0
+        self._skips_in_row = 0
+
+    def remember(self, embedding):
+        """Sets the embedding of the window a song was identified from, None forgets it."""
+        self.reference = None if embedding is None else embedding / (np.linalg.norm(embedding) or 1.0)
+        self._skips_in_row = 0
+
+    def compare(self, embedding):
+        if self.reference is None or embedding is None:
+            self.last_distance = None
+            return self.UNSURE
+        self.last_distance = 1.0 - float(self.reference @ embedding) / (float(np.linalg.norm(embedding)) or 1.0)
+        if self.last_distance > self.changed_distance:
+            return self.CHANGED
+        if self.last_distance < self.same_distance:
+            return self.SAME
+        return self.UNSURE
+
+    def should_identify(self, embedding, due, may_call_early=True):
+        """Overrides the timer's decision `due` when the embedding is conclusive. A change only
+        calls early when `may_call_early`, i.e. the last call is long enough ago.
+        """
+        verdict = self.compare(embedding)
+        if verdict == self.CHANGED and not due and may_call_early:
+            self.early += 1
+            return True
+        if verdict == self.SAME and due and self._skips_in_row < self.max_skips:
+            self._skips_in_row += 1
+            self.skipped += 1
+            return False
+        return due
+
+
+class MusicHysteresis:
+    """Debounces the music score: music starts once the score reaches `enter_threshold` for
+    `enter_windows` decisions in a row and stops once it stays below the lower
+    `exit_threshold` for `exit_windows` decisions, so a score hovering around one value
+    does not flip the state.
+    """
+
+    def __init__(self, enter_threshold=0.25, exit_threshold=0.15, enter_windows=1, exit_windows=2):
+        self.enter_threshold = enter_threshold
+        self.exit_threshold = exit_threshold
+        self.enter_windows = enter_windows
+        self.exit_windows = exit_windows
+        self.playing = False
+        self.transitions = 0
+        self._streak = 0
+
+    def observe(self, score):
+        """Feeds one window's music score, returns whether music is playing."""
+        if self.playing:
+            self._streak = self._streak + 1 if score < self.exit_threshold else 0
+            flip = self._streak >= self.exit_windows
+        else:
+            self._streak = self._streak + 1 if score >= self.enter_threshold else 0
+            flip = self._streak >= self.enter_windows
+        if flip:
+            self.playing = not self.playing
+            self.transitions += 1
+            self._streak = 0
+        return self.playing
+
+
+def load_interpreter(model_path=MODEL_PATH, num_threads=None, use_xnnpack=True):
+    """Builds the TFLite interpreter, `num_threads` None leaves the choice to the runtime.
+    XNNPACK is TFLite's default CPU delegate, `use_xnnpack=False` runs the builtin kernels only.
+    """
+    try:
+        from ai_edge_litert.interpreter import Interpreter, OpResolverType
+    except ModuleNotFoundError:
+        import tensorflow as tf
+        Interpreter, OpResolverType = tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+    resolver = OpResolverType.AUTO if use_xnnpack else OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    return Interpreter(model_path=model_path, num_threads=num_threads, experimental_op_resolver_type=resolver)
+
 
 class MusicDetector:
-    def __init__(self, recording_duration):
-        try:
-            from ai_edge_litert.interpreter import Interpreter
-            self.interpreter = Interpreter(model_path='python/ml-model/1.tflite')
-        except ModuleNotFoundError:
-            import tensorflow as tf
-            self.interpreter = tf.lite.Interpreter(model_path='python/ml-model/1.tflite')
+    def __init__(self, recording_duration, incremental=False, model_path=MODEL_PATH, num_threads=None,
+                 use_xnnpack=True, hysteresis=None):
+        """With `incremental` the interpreter is sized to a single patch and `update` only scores
+        patches it has not seen, the decision is then taken over the cached scores of the window.
+        `model_path` may point to a float16 or int8 quantized YAMNet, quantized inputs and
+        outputs are converted with the tensor's scale and zero point.
+        """
+        self.interpreter = load_interpreter(model_path, num_threads, use_xnnpack)
 
         self.down_sampled_rate = 16000
         self.raw_recording_sample_rate = 44100
+        self.incremental = incremental
         self.input_details = self.interpreter.get_input_details()
         self.output_details = self.interpreter.get_output_details()
         self.waveform_input_index = self.input_details[0]['index']
         self.scores_output_index = self.output_details[0]['index']
         self.embeddings_output_index = self.output_details[1]['index']
         self.spectrogram_output_index = self.output_details[2]['index']
-        self.interpreter.resize_tensor_input(
-            self.waveform_input_index,
-            [recording_duration * self.down_sampled_rate],
-            strict=True
-        )
+        self.waveform_dtype = self.input_details[0]['dtype']
+        self.waveform_quantization = self.input_details[0]['quantization']
+        self.scores_quantization = self.output_details[0]['quantization']
+        self.embeddings_quantization = self.output_details[1]['quantization']
+        self.input_samples = PATCH_SAMPLES if incremental else recording_duration * self.down_sampled_rate
+        self.interpreter.resize_tensor_input(self.waveform_input_index, [self.input_samples], strict=True)
         self.interpreter.allocate_tensors()
 
+        # (absolute start sample, scores, embedding) of every patch inside the latest window, oldest first
+        self.patch_scores = deque()
+        self.patches_inferred = 0
+        self._next_patch_start = 0
+        self.hysteresis = hysteresis or MusicHysteresis()
+        self.last_score = 0.0
+        # mean YAMNet embedding of the latest window that went through the model
+        self.last_embedding = None
+
         self.class_names = None
-        with open('python/ml-model/yamnet_class_map.csv') as csv_file:
+        with open(CLASS_MAP_PATH) as csv_file:
             class_map_csv = io.StringIO(csv_file.read())
             self.class_names = [display_name for (class_index, mid, display_name) in csv.reader(class_map_csv)]
             self.class_names = self.class_names[1:]  # Skip header
+        self.music_class_indices = MUSIC_CLASS_INDICES[MUSIC_CLASS_INDICES < len(self.class_names)]
 
-    def is_audio_music(self, waveform):
-        self.interpreter.set_tensor(self.waveform_input_index, waveform)
+    def warm_up(self):
+        """One dummy invoke, the first one is slow as TFLite prepares kernels and packs weights."""
+        self._invoke(np.zeros(self.input_samples, dtype=np.float32))
+
+    def _invoke(self, waveform):
+        """Runs the model on one float waveform and returns the float scores and embeddings per patch."""
+        scale, zero_point = self.waveform_quantization
+        if scale:
+            waveform = np.clip(np.rint(waveform / scale + zero_point), np.iinfo(self.waveform_dtype).min,
+                               np.iinfo(self.waveform_dtype).max)
+        self.interpreter.set_tensor(self.waveform_input_index, np.ascontiguousarray(waveform, self.waveform_dtype))
         self.interpreter.invoke()
+        return (_dequantize(self.interpreter.get_tensor(self.scores_output_index), self.scores_quantization),
+                _dequantize(self.interpreter.get_tensor(self.embeddings_output_index), self.embeddings_quantization))
+
+    def is_audio_music(self, waveform):
+        scores, embeddings = self._invoke(waveform)
+        self.patches_inferred += len(scores)
+        self.last_embedding = embeddings.mean(axis=0)
+        return self._is_music(scores)
+
+    def pending_start(self, window_start):
+        """First stream position `update` still needs samples from for a window starting at `window_start`."""
+        return max(self._next_patch_start, -(-window_start // PATCH_HOP_SAMPLES) * PATCH_HOP_SAMPLES)
+
+    def update(self, waveform, window_end, window_length=None):
+        """Incremental counterpart of `is_audio_music` for overlapping windows of a stream.
+
+        `window_end` is the absolute sample position of the end of `waveform`. Patches sit on a
+        fixed 0.48 s grid of the stream, only those not scored by an earlier window are inferred.
+        `waveform` only has to reach back to `pending_start` of a `window_length` window.
+        """
+        window_start = window_end - (len(waveform) if window_length is None else window_length)
+        waveform_start = window_end - len(waveform)
+        while self.patch_scores and self.patch_scores[0][0] < window_start:
+            self.patch_scores.popleft()
+        # first grid position inside the waveform, patches before it can no longer be scored
+        start = self.pending_start(max(window_start, waveform_start))
+        while start + PATCH_SAMPLES <= window_end:
+            patch = waveform[start - waveform_start:start - waveform_start + PATCH_SAMPLES]
+            scores, embeddings = self._invoke(patch)
+            self.patch_scores.append((start, scores[0], embeddings[0]))
+            self.patches_inferred += 1
+            start += PATCH_HOP_SAMPLES
+        self._next_patch_start = start
+        if not self.patch_scores:
+            return self.skip()
+        self.last_embedding = np.mean([embedding for _, _, embedding in self.patch_scores], axis=0)
+        return self._is_music(np.stack([scores for _, scores, _ in self.patch_scores]))
+
+    def skip(self):
+        """Counts a window that was not run through the model (e.g. gated as silence) as no music."""
+        self.last_score = 0.0
+        self.last_embedding = None
+        return self.hysteresis.observe(0.0)
 
-        scores = self.interpreter.get_tensor(self.scores_output_index)
-        scores_mean = scores.mean(axis=0)
-        top_i = scores_mean.argmax()
-        return 'Music' in self.class_names[top_i] and scores_mean[top_i] > 0.2
+    def music_score(self, scores):
+        return music_score(scores, self.music_class_indices)
 
+    def _is_music(self, scores):
+        self.last_score = self.music_score(scores)
+        return self.hysteresis.observe(self.last_score)
@@ -0,0 +1,124 @@
+import logging
+import queue
+import threading
+import time
+import traceback
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class StageMetrics:
+    """Counters and latencies of one pipeline stage, updated by the stage thread."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self._wait_total = 0.0
+        self._busy_total = 0.0
+        self.last_busy = 0.0
+        self.last_age = 0.0
+
+    def record(self, wait, busy, age):
+        """`wait` queued before the stage took the item, `busy` spent in the stage, `age` since capture."""
+        with self._lock:
+            self.processed += 1
+            self._wait_total += wait
+            self._busy_total += busy
+            self.last_busy = busy
+            self.last_age = age
+
+    def observe_depth(self, depth):
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+
+    def summary(self, depth=0):
+        with self._lock:
+            count = self.processed or 1
+            return (f'{self.name:<15} processed {self.processed:>6}  dropped {self.dropped:>4}  errors {self.errors:>3}  '
+                    f'queue {depth}/{self.max_depth} max  wait {self._wait_total / count * 1000:>7.1f} ms  '
+                    f'busy {self._busy_total / count * 1000:>7.1f} ms (last {self.last_busy * 1000:.1f})  '
+                    f'age {self.last_age * 1000:>7.1f} ms')
+
+
+class PipelineStage:
+    """One worker thread behind a bounded queue.
+
+    `put` blocks while the queue is full, so a slow stage holds back the one feeding it.
+    `offer` never blocks, it replaces the oldest queued item instead, for producers that
+    must not stall (the capture). The handler's return value, unless None, is put into
+    the downstream stage. Items are (captured_at, payload) so the age of an item at
+    every stage is known, the handler is called with both. `captured_at` is on the
+    `time.perf_counter` clock.
+    """
+
+    def __init__(self, name, handler, maxsize=1):
+        self.name = name
+        self.handler = handler
+        self.downstream = None
+        self.metrics = StageMetrics(name)
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name=f'pipeline-{name}', daemon=True)
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def put(self, payload, captured_at=None):
+        self._queue.put((time.perf_counter(), captured_at or time.perf_counter(), payload))
+        self.metrics.observe_depth(self.depth)
+
+    def offer(self, payload, captured_at=None):
+        item = (time.perf_counter(), captured_at or time.perf_counter(), payload)
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.metrics.dropped += 1
+                except queue.Empty:
+                    pass
+        self.metrics.observe_depth(self.depth)
+
+    def _run(self):
+        while True:
+            queued_at, captured_at, payload = self._queue.get()
+            started = time.perf_counter()
+            try:
+                result = self.handler(payload, captured_at)
+            except Exception as e:
+                self.metrics.errors += 1
+                logger.error(f'Pipeline stage {self.name} error: {e}')
+                logger.error(traceback.format_exc())
+                continue
+            finished = time.perf_counter()
+            self.metrics.record(started - queued_at, finished - started, finished - captured_at)
+            if result is not None and self.downstream is not None:
+                self.downstream.put(result, captured_at)
+
+
+class Pipeline:
+    """Stages connected in order: each stage's results feed the next one's queue."""
+
+    def __init__(self, *stages):
+        self.stages = stages
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.downstream = downstream
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        return self
+
+    def report(self):
+        return [stage.metrics.summary(stage.depth) for stage in self.stages]
@@ -0,0 +1,107 @@
+import logging
+
+import numpy as np
+from PIL import Image, ImageEnhance
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FLOYD_STEINBERG = 'floyd-steinberg'
+BAYER = 'bayer'
+NO_DITHER = 'none'
+DITHER_MODES = (FLOYD_STEINBERG, BAYER, NO_DITHER)
+
+# bits per channel of the RGB -> palette lookup table (32x32x32 entries)
+LUT_BITS = 5
+_LUT_LEVELS = 1 << LUT_BITS
+
+# 7-color ACeP palette (Waveshare 4.01" and the virtual panel): 4-bit panel color index -> RGB
+ACEP_PALETTE_RGB = (
+    (0, 0, 0),  # BLACK   0000
+    (255, 255, 255),  # WHITE   0001
+    (0, 255, 0),  # GREEN   0010
+    (0, 0, 255),  # BLUE    0011
+    (255, 0, 0),  # RED     0100
+    (255, 255, 0),  # YELLOW  0101
+    (255, 128, 0),  # ORANGE  0110
+)
+
+# 8x8 ordered dither thresholds, normalized to [-0.5, 0.5)
+_BAYER_8X8 = (np.array([[0, 32, 8, 40, 2, 34, 10, 42],
+                        [48, 16, 56, 24, 50, 18, 58, 26],
+                        [12, 44, 4, 36, 14, 46, 6, 38],
+                        [60, 28, 52, 20, 62, 30, 54, 22],
+                        [3, 35, 11, 43, 1, 33, 9, 41],
+                        [51, 19, 59, 27, 49, 17, 57, 25],
+                        [15, 47, 7, 39, 13, 45, 5, 37],
+                        [63, 31, 55, 23, 61, 29, 53, 21]], dtype=np.float32) + 0.5) / 64 - 0.5
+
+
+def color_indices(pixels, palette=ACEP_PALETTE_RGB):
+    """Map an (h, w, 3) uint8 RGB array to an (h, w) array of 4-bit panel color indices.
+    Colors not in `palette` map to index 0.
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    keys = (pixels[..., 0].astype(np.uint32) << 16) | (pixels[..., 1].astype(np.uint32) << 8) | pixels[..., 2]
+    indices = np.zeros(keys.shape, dtype=np.uint8)
+    for color, (r, g, b) in enumerate(palette):
+        indices[keys == ((r << 16) | (g << 8) | b)] = color
+    return indices
+
+
+def pack_indices(indices):
+    """Pack an (h, w) array of 4-bit color indices two pixels per byte, left pixel in the high nibble."""
+    indices = np.asarray(indices, dtype=np.uint8)
+    return bytearray(((indices[:, 0::2] << 4) | (indices[:, 1::2] & 0x0F)).tobytes())
+
+
+def unpack_indices(frame, width, height):
+    """Inverse of `pack_indices` for a `width` x `height` frame."""
+    packed = np.frombuffer(frame, dtype=np.uint8).reshape(height, width // 2)
+    indices = np.empty((height, width), dtype=np.uint8)
+    indices[:, 0::2] = packed >> 4
+    indices[:, 1::2] = packed & 0x0F
+    return indices
+
+
+class Quantizer:
+    """Maps RGB images to an (h, w) uint8 array of panel palette indices.
+
+    The palette is built once. Floyd-Steinberg runs in Pillow's C quantizer against a cached
+    palette image, `bayer` and `none` are lookups in a cached 5-bit RGB table.
+    """
+
+    def __init__(self, palette, dither: str = FLOYD_STEINBERG, color_boost: float = 1.0, bayer_spread: float = 64.0):
+        if dither not in DITHER_MODES:
+            raise ValueError(f'Unsupported dither mode: {dither}, expected one of {", ".join(DITHER_MODES)}')
+        self.palette = np.asarray(palette, dtype=np.float32).reshape(-1, 3)
+        self.dither = dither
+        self.color_boost = color_boost
+        self.bayer_spread = bayer_spread
+        self.lut = self._build_lut(self.palette)
+        # only the panel colors, so Pillow never picks an index past the palette
+        self._palette_image = Image.new('P', (1, 1))
+        self._palette_image.putpalette(np.rint(self.palette).astype(np.uint8).reshape(-1).tolist())
+
+    @staticmethod
+    def _build_lut(palette):
+        levels = np.linspace(0, 255, _LUT_LEVELS, dtype=np.float32)
+        grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+        return ((grid - palette[np.newaxis]) ** 2).sum(axis=-1).argmin(axis=1).astype(np.uint8)
+
+    def _lookup(self, rgb):
+        q = (np.clip(rgb, 0, 255) * ((_LUT_LEVELS - 1) / 255) + 0.5).astype(np.intp)
+        return self.lut[(q[..., 0] << (2 * LUT_BITS)) | (q[..., 1] << LUT_BITS) | q[..., 2]]
+
+    def quantize(self, image: Image) -> np.ndarray:
+        image = image.convert('RGB')
+        if self.color_boost != 1.0:
+            image = ImageEnhance.Color(image).enhance(self.color_boost)
+        if self.dither == FLOYD_STEINBERG:
+            return np.asarray(image.quantize(palette=self._palette_image, dither=Image.Dither.FLOYDSTEINBERG))
+        rgb = np.asarray(image, dtype=np.float32)
+        if self.dither == BAYER:
+            h, w, _ = rgb.shape
+            thresholds = np.tile(_BAYER_8X8, (h // 8 + 1, w // 8 + 1))[:h, :w]
+            return self._lookup(rgb + thresholds[..., np.newaxis] * self.bayer_spread)
+        return self._lookup(rgb)
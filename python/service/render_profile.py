@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import configparser
+import hashlib
+import os
+from dataclasses import dataclass, field
+
+from PIL import ImageFont
+
+from service.display_backend import DISPLAY_BACKENDS
+from service.quantizer import DITHER_MODES, FLOYD_STEINBERG
+
+TEXT_DIRECTIONS = ('top-down', 'bottom-up')
+BACKGROUND_MODES = ('fit', 'repeat')
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'cache')
+
+
+class OptionReader:
+    """Typed, validated access to one section of eink_options.ini.
+
+    Without `fallback` a missing option raises configparser.NoOptionError, invalid values
+    raise ValueError naming the option.
+    """
+
+    def __init__(self, config: configparser.ConfigParser, section: str = 'DEFAULT'):
+        self.config = config
+        self.section = section
+
+    def get(self, key, getter=None, **fallback):
+        # only pass `fallback` when given, so a missing required option raises NoOptionError
+        return (getter or self.config.get)(self.section, key, **fallback)
+
+    def boolean(self, key, **fallback):
+        return self.get(key, self.config.getboolean, **fallback)
+
+    def choice(self, key, allowed, **fallback):
+        value = self.get(key, **fallback)
+        if value not in allowed:
+            raise ValueError(f'Invalid {key} = {value} in eink_options.ini, expected one of {", ".join(allowed)}')
+        return value
+
+    def non_negative_int(self, key, **fallback):
+        return self._non_negative(key, self.config.getint, **fallback)
+
+    def non_negative_float(self, key, **fallback):
+        return self._non_negative(key, self.config.getfloat, **fallback)
+
+    def _non_negative(self, key, getter, **fallback):
+        value = self.get(key, getter, **fallback)
+        if value < 0:
+            raise ValueError(f'Invalid {key} = {value} in eink_options.ini, expected a number >= 0')
+        return value
+
+
+# options that change the pixels of a rendered frame, only these go into config_hash
+FRAME_OPTIONS = ('model', 'width', 'height', 'album_cover_small', 'album_cover_small_px', 'no_song_cover',
+                 'font_path', 'font_size_title', 'font_size_artist', 'offset_px_left', 'offset_px_right',
+                 'offset_px_top', 'offset_px_bottom', 'offset_text_px_shadow', 'text_direction', 'background_mode',
+                 'dither_mode')
+
+
+@dataclass(frozen=True, slots=True)
+class RenderProfile:
+    """Display and render options of eink_options.ini parsed and validated once, the render path
+    only reads attributes. Audio, model and network options live in ServiceSettings.
+    """
+    model: str
+    width: int
+    height: int
+    album_cover_small: bool
+    album_cover_small_px: int
+    display_refresh_counter: int
+    no_song_cover: str
+    font_path: str
+    font_size_title: int
+    font_size_artist: int
+    offset_px_left: int
+    offset_px_right: int
+    offset_px_top: int
+    offset_px_bottom: int
+    offset_text_px_shadow: int
+    text_direction: str
+    background_mode: str
+    dither_mode: str
+    last_frame_state: str
+    frame_cache_dir: str
+    frame_cache_max_mb: int
+    virtual_output_dir: str
+    virtual_refresh_seconds: float
+    # hash of the FRAME_OPTIONS, changing one of them alters the rendered frame
+    config_hash: str
+    font_title: ImageFont.FreeTypeFont = field(repr=False, compare=False)
+    font_artist: ImageFont.FreeTypeFont = field(repr=False, compare=False)
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser, section: str = 'DEFAULT') -> RenderProfile:
+        """Raises ValueError (or configparser.Error for missing options) on an invalid config."""
+        options = OptionReader(config, section)
+        values = dict(
+            model=options.choice('model', tuple(DISPLAY_BACKENDS)),
+            width=options.non_negative_int('width'),
+            height=options.non_negative_int('height'),
+            album_cover_small=options.boolean('album_cover_small'),
+            album_cover_small_px=options.non_negative_int('album_cover_small_px'),
+            display_refresh_counter=options.non_negative_int('display_refresh_counter'),
+            no_song_cover=options.get('no_song_cover'),
+            font_path=options.get('font_path'),
+            font_size_title=options.non_negative_int('font_size_title'),
+            font_size_artist=options.non_negative_int('font_size_artist'),
+            offset_px_left=options.non_negative_int('offset_px_left'),
+            offset_px_right=options.non_negative_int('offset_px_right'),
+            offset_px_top=options.non_negative_int('offset_px_top'),
+            offset_px_bottom=options.non_negative_int('offset_px_bottom'),
+            offset_text_px_shadow=options.non_negative_int('offset_text_px_shadow'),
+            text_direction=options.choice('text_direction', TEXT_DIRECTIONS),
+            background_mode=options.choice('background_mode', BACKGROUND_MODES),
+            dither_mode=options.choice('dither_mode', DITHER_MODES, fallback=FLOYD_STEINBERG),
+            last_frame_state=options.get('last_frame_state', fallback=os.path.join(CACHE_DIR, 'last_frame')),
+            frame_cache_dir=options.get('frame_cache_dir', fallback=os.path.join(CACHE_DIR, 'frames')),
+            frame_cache_max_mb=options.non_negative_int('frame_cache_max_mb', fallback=100),
+            virtual_output_dir=options.get('virtual_output_dir', fallback=os.path.join(CACHE_DIR, 'virtual')),
+            virtual_refresh_seconds=options.non_negative_float('virtual_refresh_seconds', fallback=30.0),
+        )
+        frame_options = repr([(name, values[name]) for name in FRAME_OPTIONS])
+        return cls(
+            **values,
+            config_hash=hashlib.blake2b(frame_options.encode(), digest_size=16).hexdigest(),
+            # fonts are loaded once and shared by every render
+            font_title=ImageFont.truetype(values['font_path'], values['font_size_title']),
+            font_artist=ImageFont.truetype(values['font_path'], values['font_size_artist']),
+        )
@@ -0,0 +1,102 @@
+from math import gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class PolyphaseResampler:
+    """Rational polyphase resampler (up/down) that can be fed chunk by chunk.
+
+    The filter and its result match `scipy.signal.resample_poly` (Kaiser windowed sinc,
+    beta 5, 10 zero crossings per side, group delay compensated), but the input history
+    and output phase are carried between `process` calls, so a stream resampled in
+    chunks gives the same samples as the whole signal resampled at once.
+    """
+
+    def __init__(self, in_rate=44100, out_rate=16000, half_len_factor=10, beta=5.0, block=4096):
+        common = gcd(in_rate, out_rate)
+        self.up = out_rate // common
+        self.down = in_rate // common
+        max_rate = max(self.up, self.down)
+        half_len = half_len_factor * max_rate
+        n = np.arange(2 * half_len + 1) - half_len
+        taps = np.sinc(n / max_rate) * np.kaiser(2 * half_len + 1, beta)
+        taps *= self.up / taps.sum()
+        # phase p holds taps p, p + up, p + 2 up, ... reversed, so a phase dots with the
+        # input window in natural (oldest first) order
+        self.taps_per_phase = -(-len(taps) // self.up)
+        padded = np.zeros(self.up * self.taps_per_phase, dtype=np.float32)
+        padded[:len(taps)] = taps
+        self.phases = padded.reshape(self.taps_per_phase, self.up).T[:, ::-1].copy()
+        self.delay = half_len
+        self.block = block
+        self.reset()
+
+    def reset(self):
+        # the filter looks taps_per_phase - 1 samples into the past, which start out as silence
+        self._history = np.zeros(self.taps_per_phase - 1, dtype=np.float32)
+        self._consumed = 0  # input samples seen
+        self._produced = 0  # output samples emitted
+
+    def _output_source(self, m):
+        # output m sits at upsampled index m * down + delay, i.e. input sample j0 and phase p
+        return divmod(m * self.down + self.delay, self.up)
+
+    def process(self, chunk):
+        """Resamples the next chunk of the stream, returns every output sample it completes."""
+        chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+        data = np.concatenate((self._history, chunk))
+        self._consumed += len(chunk)
+        # data[0] is absolute input sample `first`
+        first = self._consumed - len(data)
+        # outputs whose newest input sample has arrived
+        available = max(0, -(-(self._consumed * self.up - self.delay) // self.down))
+        out = self._compute(data, first, self._produced, available)
+        self._produced = max(self._produced, available)
+        self._history = data[len(data) - (self.taps_per_phase - 1):]
+        return out
+
+    def flush(self, total_input=None):
+        """Pads the stream with silence and returns the outputs it still owes, so the whole
+        stream yields ceil(total_input * up / down) samples like `resample_poly`.
+        """
+        total_input = self._consumed if total_input is None else total_input
+        expected = -(-total_input * self.up // self.down)
+        owed = expected - self._produced
+        if owed <= 0:
+            return np.zeros(0, dtype=np.float32)
+        last_j0, _ = self._output_source(expected - 1)
+        padding = np.zeros(max(0, last_j0 + 1 - self._consumed), dtype=np.float32)
+        out = self.process(padding)
+        return out[:owed]
+
+    def resample(self, signal):
+        """One-shot resampling of a whole signal, the stream state is reset before and after."""
+        self.reset()
+        total = len(signal)
+        out = np.concatenate((self.process(signal), self.flush(total)))
+        self.reset()
+        return out
+
+    def _compute(self, data, first, start, stop):
+        if stop <= start:
+            return np.zeros(0, dtype=np.float32)
+        windows = sliding_window_view(data, self.taps_per_phase)
+        out = np.empty(stop - start, dtype=np.float32)
+        if stop - start >= self.up * 8:
+            # outputs up apart share a phase and their input windows are down apart, so each
+            # phase is one strided view times one tap vector
+            for k in range(self.up):
+                j0, p = self._output_source(start + k)
+                count = len(range(start + k, stop, self.up))
+                row = j0 - first - (self.taps_per_phase - 1)
+                out[k::self.up] = windows[row:row + (count - 1) * self.down + 1:self.down] @ self.phases[p]
+            return out
+        # small chunks (capture callbacks): gather each output's window, in blocks to bound memory
+        for block_start in range(start, stop, self.block):
+            m = np.arange(block_start, min(stop, block_start + self.block))
+            j0, p = self._output_source(m)
+            # window ends at input j0, which sits at data index j0 - first
+            rows = windows[j0 - first - (self.taps_per_phase - 1)]
+            out[block_start - start:block_start - start + len(m)] = np.einsum('ij,ij->i', rows, self.phases[p])
+        return out
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import configparser
+import os
+from dataclasses import dataclass, field
+
+from service.music_detector import MODEL_PATH
+from service.render_profile import CACHE_DIR, OptionReader
+
+UNITS = ('metric', 'imperial')
+
+
+@dataclass(frozen=True, slots=True)
+class ServiceSettings:
+    """Audio capture, music model and network options of eink_options.ini, parsed and validated once.
+
+    Kept apart from RenderProfile, so changing one of them does not invalidate rendered frames.
+    """
+    shazampi_log: str
+    openweathermap_api_key: str = field(repr=False)
+    geo_coordinates: str
+    units: str
+    streaming_capture: bool
+    audio_gate: bool
+    incremental_detection: bool
+    yamnet_model: str
+    yamnet_threads: int
+    yamnet_xnnpack: bool
+    music_enter_threshold: float
+    music_exit_threshold: float
+    embedding_check: bool
+    pipeline: bool
+    duration_cache: str
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser, section: str = 'DEFAULT') -> ServiceSettings:
+        """Raises ValueError (or configparser.Error for missing options) on an invalid config."""
+        options = OptionReader(config, section)
+        music_enter_threshold = options.non_negative_float('music_enter_threshold', fallback=0.25)
+        music_exit_threshold = options.non_negative_float('music_exit_threshold', fallback=0.15)
+        if music_exit_threshold > music_enter_threshold:
+            raise ValueError(f'Invalid music_exit_threshold = {music_exit_threshold} in eink_options.ini, '
+                             f'expected a number <= music_enter_threshold')
+        return cls(
+            shazampi_log=options.get('shazampi_log'),
+            openweathermap_api_key=options.get('openweathermap_api_key'),
+            geo_coordinates=options.get('geo_coordinates'),
+            units=options.choice('units', UNITS),
+            streaming_capture=options.boolean('streaming_capture', fallback=True),
+            audio_gate=options.boolean('audio_gate', fallback=True),
+            incremental_detection=options.boolean('incremental_detection', fallback=False),
+            yamnet_model=options.get('yamnet_model', fallback=MODEL_PATH),
+            yamnet_threads=options.non_negative_int('yamnet_threads', fallback=0),
+            yamnet_xnnpack=options.boolean('yamnet_xnnpack', fallback=True),
+            music_enter_threshold=music_enter_threshold,
+            music_exit_threshold=music_exit_threshold,
+            embedding_check=options.boolean('embedding_check', fallback=True),
+            pipeline=options.boolean('pipeline', fallback=False),
+            duration_cache=options.get('duration_cache', fallback=os.path.join(CACHE_DIR, 'durations.json')),
+        )
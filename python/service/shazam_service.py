@@ -1,55 +1,175 @@
 import asyncio
 import logging
+import re
+import threading
+import time
 
-import requests
-from shazamio import Shazam
+from service.duration_resolver import DurationResolver
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# host of shazamio's recognition endpoint, warmed up before the first match
+SHAZAM_URL = 'https://amp.shazam.com/'
+# Apple's image CDN renders covers at the size named in the last path element, e.g. .../400x400cc.jpg
+_COVER_SIZE = re.compile(r'/\d+x\d+(\w*)\.(jpg|jpeg|png|webp)$')
+
+
+def cover_url_for_size(url, size):
+    """Asks the cover CDN for a `size` x `size` image, other URLs are returned unchanged."""
+    return _COVER_SIZE.sub(rf'/{size}x{size}\1.\2', url)
+
+
+class PooledHTTPClient:
+    """HTTP client for shazamio that keeps one aiohttp session for the service's lifetime.
+
+    shazamio's own client opens a new session per request, so every recognition paid for DNS,
+    TCP and TLS again. This one reuses keep-alive connections and caches DNS answers. It
+    has to be used from a single event loop, the session is bound to the loop that made it.
+    """
+
+    def __init__(self, timeout=15, limit=4, keepalive_timeout=120, dns_ttl=600):
+        self.timeout = timeout
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self._session = None
+
+    def _get_session(self):
+        import aiohttp
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=self.dns_ttl)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def request(self, method, url, content_type='application/json', **kwargs):
+        """Same contract as shazamio's HTTPClientInterface.request: returns the decoded JSON body."""
+        async with self._get_session().request(method, url, **kwargs) as response:
+            return await response.json(content_type=content_type)
+
+    async def warm_up(self, url):
+        """Opens a keep-alive connection to `url`'s host (DNS, TCP and TLS) and leaves it in the pool."""
+        async with self._get_session().head(url, allow_redirects=False) as response:
+            await response.read()
+
+    async def fetch_bytes(self, url):
+        async with self._get_session().get(url) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
 
 class ShazamService:
-    def __init__(self):
-        self.shazam = Shazam()
+    """Owns one event loop on a dedicated thread with one Shazam client, created once.
 
-    async def _recognize_song(self, audio_wav_buffer):
-        return await self.shazam.recognize(audio_wav_buffer.read())
+    `identify_song` is the blocking entry point, `identify_song_async` can be awaited from
+    any other event loop. Both run the recognition on the service's loop, where the pooled
+    HTTP session lives.
 
-    def identify_song(self, audio_wav_buffer):
-        loop = asyncio.new_event_loop()
-        try:
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(self._recognize_song(audio_wav_buffer))
-            if result and 'track' in result:
-                track = result['track']
-                album_art = track.get('images', {}).get('coverart', 'No cover art available')
-                isrc = track.get('isrc', {})
-                offset = result['matches'][0].get('offset', {})
-                song_duration = fetch_song_duration(isrc)
-                return {
-                    'title': track.get('title', 'Unknown'),
-                    'artist': track.get('subtitle', 'Unknown'),
-                    'album': next((item['text'] for item in track.get('sections', [{}])[0].get('metadata', []) if
-                                   item.get('title') == 'Album'), 'Unknown'),
-                    'album_art': album_art,
-                    'offset': offset,
-                    'song_duration': song_duration
-                }
+    After a match the duration lookup and the cover download run concurrently and share
+    `enrichment_deadline`, whatever is not ready by then is left out (None). Covers are
+    requested at `cover_size` pixels when set, and only if `cover_needed(title, artist,
+    album_art)` says so, e.g. when no rendered frame is cached for the track.
+    """
+
+    def __init__(self, timeout=30, duration_resolver=None, cover_size=None, cover_needed=None,
+                 enrichment_deadline=8.0):
+        # shazamio pulls in aiohttp and pydantic, only pay for that when the service is created
+        from shazamio import Shazam
+        self.timeout = timeout
+        self.duration_resolver = duration_resolver or DurationResolver()
+        self.cover_size = cover_size
+        self.cover_needed = cover_needed
+        self.enrichment_deadline = enrichment_deadline
+        self.http_client = PooledHTTPClient()
+        self.shazam = Shazam(http_client=self.http_client)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='shazam-loop', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _identify(self, audio_payload):
+        result = await self.shazam.recognize(audio_payload)
+        if result and 'track' in result:
+            track = result['track']
+            album_art = track.get('images', {}).get('coverart', 'No cover art available')
+            if self.cover_size and album_art.startswith('http'):
+                album_art = cover_url_for_size(album_art, self.cover_size)
+            isrc = track.get('isrc', {})
+            offset = result['matches'][0].get('offset', {})
+            song_info = {
+                'title': track.get('title', 'Unknown'),
+                'artist': track.get('subtitle', 'Unknown'),
+                'album': next((item['text'] for item in track.get('sections', [{}])[0].get('metadata', []) if
+                               item.get('title') == 'Album'), 'Unknown'),
+                'album_art': album_art,
+                'offset': offset,
+            }
+            song_info.update(await self._enrich(song_info, isrc))
+            return song_info
+        return None
+
+    async def _enrich(self, song_info, isrc):
+        """Fetches the duration and the cover concurrently, returns what arrived before the deadline."""
+        started = time.perf_counter()
+        # the lookup is blocking (and may wait for the rate limit), keep it off the loop
+        tasks = {'song_duration': asyncio.ensure_future(
+            self.loop.run_in_executor(None, self.duration_resolver.resolve, isrc))}
+        if song_info['album_art'].startswith('http') and (
+                self.cover_needed is None
+                or self.cover_needed(song_info['title'], song_info['artist'], song_info['album_art'])):
+            tasks['album_art_data'] = asyncio.ensure_future(self.http_client.fetch_bytes(song_info['album_art']))
+        await asyncio.wait(tasks.values(), timeout=self.enrichment_deadline)
+        enrichment = {}
+        for name, task in tasks.items():
+            if not task.done():
+                # a late duration still lands in the resolver's cache, only the cover is dropped
+                task.cancel()
+                logger.warning(f'{name} not ready within {self.enrichment_deadline} s, skipped')
+                enrichment[name] = None
+            elif task.exception() is not None:
+                logger.error(f'{name} failed: {task.exception()!r}')
+                enrichment[name] = None
             else:
-                return None
+                enrichment[name] = task.result()
+        logger.info(f'Enrichment of {", ".join(tasks)} took {(time.perf_counter() - started) * 1000:.0f} ms')
+        return enrichment
+
+    def warm_up(self):
+        """Connects to the Shazam host ahead of the first recognition, failures are only logged."""
+        future = asyncio.run_coroutine_threadsafe(self.http_client.warm_up(SHAZAM_URL), self.loop)
+        try:
+            future.result(self.http_client.timeout)
         except Exception as ex:
-            logger.error(ex)
-        finally:
-            loop.close()
-
-
-def fetch_song_duration(isrc):
-    # MusicBrainz API endpoint for ISRC
-    url = f'https://musicbrainz.org/ws/2/recording/?query=isrc:{isrc}&fmt=json'
-    try:
-        response = requests.get(url)
-        data = response.json()
-        song_duration = data.get('recordings')[0].get('length')
-        return song_duration/1000
-    except Exception as ex:
-        logger.error(ex)
+            future.cancel()
+            logger.warning(f'Shazam connection warm-up failed: {ex!r}')
+
+    async def identify_song_async(self, audio_payload):
+        """Awaitable `identify_song` for callers running their own event loop."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._identify(audio_payload), self.loop))
+
+    def identify_song(self, audio_payload):
+        """audio_payload: bytes or bytearray of an audio file, see AudioService.encode_pcm16"""
+        future = asyncio.run_coroutine_threadsafe(self._identify(audio_payload), self.loop)
+        try:
+            return future.result(self.timeout)
+        except Exception as ex:
+            future.cancel()
+            logger.error(f'Shazam recognition failed: {ex!r}')
+            return None
+
+    def close(self):
+        """Closes the pooled connections and stops the loop."""
+        asyncio.run_coroutine_threadsafe(self.http_client.close(), self.loop).result(self.timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(self.timeout)
+
@@ -0,0 +1,51 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Times the startup steps, in the foreground or on warm-up threads, relative to one origin."""
+
+    def __init__(self, workers=2):
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='warm-up')
+        # (name, started at, duration or None for a milestone, thread name)
+        self.entries = []
+
+    def _record(self, name, started, duration):
+        with self._lock:
+            self.entries.append((name, started - self._origin, duration, threading.current_thread().name))
+
+    @contextmanager
+    def step(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, started, time.perf_counter() - started)
+
+    def background(self, name, func, *args):
+        """Runs `func(*args)` as a timed step on a warm-up thread, returns its Future."""
+        def run():
+            with self.step(name):
+                return func(*args)
+        return self._executor.submit(run)
+
+    def milestone(self, name):
+        self._record(name, time.perf_counter(), None)
+
+    def report(self):
+        """Returns the entries in start order as printable lines."""
+        with self._lock:
+            entries = sorted(self.entries, key=lambda entry: entry[1])
+        lines = []
+        for name, started, duration, thread in entries:
+            took = '' if duration is None else f'{duration * 1000:>8.0f} ms'
+            lines.append(f'{started * 1000:>8.0f} ms {took:>11}  {name} [{thread}]')
+        return lines
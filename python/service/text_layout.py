@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from itertools import accumulate
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+@lru_cache(maxsize=256)
+def layout_lines(text: str, font: ImageFont.FreeTypeFont, max_width: int) -> tuple[str, ...]:
+    """Greedy line breaking: each word and the space are measured once, lines are cut
+    from cumulative widths. A single word wider than `max_width` gets a line of its own.
+    """
+    words = text.split() if text else []
+    if not words:
+        return ()
+    space = font.getlength(' ')
+    # ends[i] is the width of words[:i + 1] joined by spaces, starting from the first word
+    ends = list(accumulate((font.getlength(word) for word in words), lambda total, w: total + space + w))
+    lines = []
+    start = 0
+    line_origin = 0.0
+    for i in range(1, len(words)):
+        if int(ends[i] - line_origin) > max_width:
+            lines.append(' '.join(words[start:i]))
+            start = i
+            # the next line starts at words[i], drop the width before it and the space
+            line_origin = ends[i - 1] + space
+    lines.append(' '.join(words[start:]))
+    return tuple(lines)
+
+
+def fit_text(img: Image, text: str, text_color: str, shadow_text_color: str, font: ImageFont.FreeTypeFont,
+             y_offset: int, font_size: int, x_start_offset: int = 0, x_end_offset: int = 0,
+             offset_text_px_shadow: int = 0, bottom_up: bool = False) -> int:
+    """
+    Fit text into container after applying line breaks. Returns the total
+    height taken up by the text. With `bottom_up` the last line sits at `y_offset`
+    and earlier lines grow upwards.
+    """
+    width = img.width - x_start_offset - x_end_offset - offset_text_px_shadow
+    lines = layout_lines(text, font, width)
+    if not lines:
+        return 0
+    y = y_offset
+    if bottom_up:
+        y -= (len(lines) - 1) * font_size
+    # draw the block once into a coverage mask, text and shadow are then filled through it
+    mask = Image.new('L', img.size)
+    draw = ImageDraw.Draw(mask)
+    for t in lines:
+        draw.text((x_start_offset, y), t, font=font, fill=255)
+        y += font_size
+    if offset_text_px_shadow > 0:
+        shadow_mask = mask.crop((-offset_text_px_shadow, -offset_text_px_shadow,
+                                 img.width - offset_text_px_shadow, img.height - offset_text_px_shadow))
+        img.paste(shadow_text_color, (0, 0, img.width, img.height), shadow_mask)
+    img.paste(text_color, (0, 0, img.width, img.height), mask)
+    return len(lines) * font_size
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import datetime
-import time
+import functools
+import io
 import sys
 import logging
+import time
 from collections import namedtuple
 from enum import Enum
 from logging.handlers import RotatingFileHandler
@@ -13,14 +15,31 @@ import configparser
 
 import requests
 import signal
-from PIL import Image, ImageDraw, ImageFont, ImageOps, ImageEnhance
+from PIL import Image, ImageOps
 
+from service.audio_gate import AudioGate
 from service.audio_service import AudioService
-from service.music_detector import MusicDetector
+from service.cover_image import open_cover
+from service.display_backend import create_display_backend
+from service.display_worker import DisplayWorker
+from service.duration_resolver import DurationResolver
+from service.frame_cache import LastFrameStore, RenderedFrameCache, frame_digest
+from service.identification_scheduler import IdentificationScheduler
+from service.music_detector import PATCH_HOP_SECONDS, MusicDetector, MusicHysteresis, SongChangeDetector
+from service.pipeline import Pipeline, PipelineStage
+from service.render_profile import RenderProfile
+from service.service_settings import ServiceSettings
 from service.shazam_service import ShazamService
+from service.startup import StartupTimer
+from service.text_layout import fit_text
 from service.weather_service import WeatherService
 
-SongInfo = namedtuple('SongInfo', ['title', 'artist', 'album_art', 'offset', 'song_duration'])
+# how often the pipeline mode logs its stage metrics
+PIPELINE_REPORT_SECONDS = 300
+
+# album_art_data holds the cover when it was fetched together with the match, None otherwise
+SongInfo = namedtuple('SongInfo', ['title', 'artist', 'album_art', 'offset', 'song_duration', 'album_art_data'],
+                      defaults=[None])
 
 
 class ViewState(Enum):
@@ -35,45 +54,93 @@ class ShazampiEinkDisplay:
         signal.signal(signal.SIGTERM, self._handle_sigterm)
         self.delay = delay
         self.recording_duration = recording_duration
-
-        # Configuration for the matrix
-        self.config = configparser.ConfigParser()
-        self.config.read(os.path.join(os.path.dirname(__file__), '..', 'config', 'eink_options.ini'))
+        self.startup = StartupTimer()
+
+        # Configuration for the matrix, parsed once so a bad config fails here and not mid-render
+        with self.startup.step('config and fonts'):
+            config = configparser.ConfigParser()
+            config.read(os.path.join(os.path.dirname(__file__), '..', 'config', 'eink_options.ini'))
+            self.profile = RenderProfile.from_config(config)
+            self.settings = ServiceSettings.from_config(config)
         # set shazampi lib logger
         logging.basicConfig(format='%(asctime)s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
-                            filename=self.config.get('DEFAULT', 'shazampi_log'), level=logging.INFO)
+                            filename=self.settings.shazampi_log, level=logging.INFO)
         logger = logging.getLogger('shazampi_logger')
         # automatically deletes logs more than 2000 bytes
-        handler = RotatingFileHandler(self.config.get('DEFAULT', 'shazampi_log'), maxBytes=2000, backupCount=3)
+        handler = RotatingFileHandler(self.settings.shazampi_log, maxBytes=2000, backupCount=3)
         logger.addHandler(handler)
 
         # setup services
-        self.audio_service = AudioService()
-        self.music_detector = MusicDetector(self.recording_duration)
-        self.shazam_service = ShazamService()
-
-        openweathermap_api_key = self.config.get('DEFAULT', 'openweathermap_api_key')
-        geo_coordinates = self.config.get('DEFAULT', 'geo_coordinates')
-        units = self.config.get('DEFAULT', 'units')
-        self.weather_service = WeatherService(api_key=openweathermap_api_key,
-                                              geo_coordinates=geo_coordinates,
-                                              units=units)
+        # incremental detection needs the patch positions of a continuous stream
+        self.incremental_detection = self.settings.incremental_detection and self.settings.streaming_capture
+        # the model and the Shazam client load on warm-up threads while the first window records,
+        # start() picks them up once it has that window
+        self.music_detector = None
+        self.shazam_service = None
+        self.weather_info = None
+        self.startup_reported = False
+        self._music_detector_loading = self.startup.background('music model load and warm-up',
+                                                               self._load_music_detector)
+        self._shazam_service_loading = self.startup.background('shazam client', self._load_shazam_service)
+        with self.startup.step('audio device'):
+            self.audio_service = AudioService()
+        # skips YAMNet on silent or steady-noise windows, judged on the level before normalization
+        self.audio_gate = AudioGate() if self.settings.audio_gate else None
+        # compares YAMNet embeddings with the window the current song was identified from
+        self.song_change = SongChangeDetector() if self.settings.embedding_check else None
+
+        self.weather_service = WeatherService(api_key=self.settings.openweathermap_api_key,
+                                              geo_coordinates=self.settings.geo_coordinates,
+                                              units=self.settings.units)
 
         # prep some vars before entering service loop
         self.pic_counter = 0
         self.current_view = ViewState.UNKNOWN
+        self.last_frame = LastFrameStore(self.profile.last_frame_state)
         self.logger = self._init_logger()
         self.logger.info('Service instance created')
-        if self.config.get('DEFAULT', 'model') == 'inky':
-            from inky.auto import auto
-            from inky.inky_uc8159 import CLEAN
-            self.inky_auto = auto
-            self.inky_clean = CLEAN
-            self.logger.info('Loading Pimoroni inky lib')
-        if self.config.get('DEFAULT', 'model') == 'waveshare4':
-            from lib import epd4in01f
-            self.wave4 = epd4in01f
-            self.logger.info('Loading Waveshare 4" lib')
+        with self.startup.step(f'{self.profile.model} display backend'):
+            self.display = create_display_backend(self.profile)
+        self.frame_cache = RenderedFrameCache(self.profile.frame_cache_dir,
+                                              max_bytes=self.profile.frame_cache_max_mb * 1024 * 1024,
+                                              config_hash=self.profile.config_hash, model=self.profile.model)
+        # rendering and panel refreshes run here so audio capture never waits on the display
+        self.display_worker = DisplayWorker()
+
+    def _load_music_detector(self) -> MusicDetector:
+        music_detector = MusicDetector(self.recording_duration, incremental=self.incremental_detection,
+                                       model_path=self.settings.yamnet_model,
+                                       num_threads=self.settings.yamnet_threads or None,
+                                       use_xnnpack=self.settings.yamnet_xnnpack,
+                                       hysteresis=MusicHysteresis(self.settings.music_enter_threshold,
+                                                                  self.settings.music_exit_threshold))
+        music_detector.warm_up()
+        return music_detector
+
+    def _load_shazam_service(self) -> ShazamService:
+        # 'fit' scales the cover to the panel, so ask for it at the panel's size; 'repeat' tiles it as delivered
+        cover_size = max(self.profile.width, self.profile.height) if self.profile.background_mode == 'fit' else None
+        shazam_service = ShazamService(duration_resolver=DurationResolver(self.settings.duration_cache),
+                                       cover_size=cover_size, cover_needed=self._cover_needed)
+        # the first recognition then reuses a pooled connection instead of paying for DNS, TCP and TLS
+        with self.startup.step('shazam connection warm-up'):
+            shazam_service.warm_up()
+        return shazam_service
+
+    def _cover_needed(self, title, artist, album_art) -> bool:
+        """a cover is only downloaded with the match if the frame for the track is not cached yet"""
+        return not self.frame_cache.contains(self.frame_cache.key(title, artist, album_art))
+
+    def _finish_startup(self):
+        """waits for the warm-up threads, a service that failed to load stops the process"""
+        try:
+            self.music_detector = self._music_detector_loading.result()
+            self.shazam_service = self._shazam_service_loading.result()
+            self.weather_info = self._weather_loading.result()
+        except Exception as e:
+            self.logger.error(f'Startup failed: {e}')
+            self.logger.error(traceback.format_exc())
+            sys.exit(1)
 
     def _init_logger(self):
         logger = logging.getLogger(__name__)
@@ -88,140 +155,57 @@ class ShazampiEinkDisplay:
         self.logger.warning('SIGTERM received stopping')
         sys.exit(0)
 
-    def _break_fix(self, text: str, width: int, font: ImageFont, draw: ImageDraw):
-        """
-        Fix line breaks in text.
-        """
-        if not text:
-            return
-        if isinstance(text, str):
-            text = text.split()  # this creates a list of words
-        lo = 0
-        hi = len(text)
-        while lo < hi:
-            mid = (lo + hi + 1) // 2
-            t = ' '.join(text[:mid])  # this makes a string again
-            w = int(draw.textlength(text=t, font=font))
-            if w <= width:
-                lo = mid
-            else:
-                hi = mid - 1
-        t = ' '.join(text[:lo])  # this makes a string again
-        w = int(draw.textlength(text=t, font=font))
-        yield t, w
-        yield from self._break_fix(text[lo:], width, font, draw)
-
-    def _fit_text_top_down(self, img: Image, text: str, text_color: str, shadow_text_color: str, font: ImageFont,
-                           y_offset: int, font_size: int, x_start_offset: int = 0, x_end_offset: int = 0,
-                           offset_text_px_shadow: int = 0) -> int:
-        """
-        Fit text into container after applying line breaks. Returns the total
-        height taken up by the text
-        """
-        width = img.width - x_start_offset - x_end_offset - offset_text_px_shadow
-        draw = ImageDraw.Draw(img)
-        pieces = list(self._break_fix(text, width, font, draw))
-        y = y_offset
-        h_taken_by_text = 0
-        for t, _ in pieces:
-            if offset_text_px_shadow > 0:
-                draw.text((x_start_offset + offset_text_px_shadow, y + offset_text_px_shadow), t, font=font,
-                          fill=shadow_text_color)
-            draw.text((x_start_offset, y), t, font=font, fill=text_color)
-            new_height = font_size
-            y += font_size
-            h_taken_by_text += new_height
-        return h_taken_by_text
-
-    def _fit_text_bottom_up(self, img: Image, text: str, text_color: str, shadow_text_color: str, font: ImageFont,
-                            y_offset: int, font_size: int, x_start_offset: int = 0, x_end_offset: int = 0,
-                            offset_text_px_shadow: int = 0) -> int:
-        """
-        Fit text into container after applying line breaks. Returns the total
-        height taken up by the text
-        """
-        width = img.width - x_start_offset - x_end_offset - offset_text_px_shadow
-        draw = ImageDraw.Draw(img)
-        pieces = list(self._break_fix(text, width, font, draw))
-        y = y_offset
-        if len(pieces) > 1:
-            y -= (len(pieces) - 1) * font_size
-        h_taken_by_text = 0
-        for t, _ in pieces:
-            if offset_text_px_shadow > 0:
-                draw.text((x_start_offset + offset_text_px_shadow, y + offset_text_px_shadow), t, font=font,
-                          fill=shadow_text_color)
-            draw.text((x_start_offset, y), t, font=font, fill=text_color)
-            new_height = font_size
-            y += font_size
-            h_taken_by_text += new_height
-        return h_taken_by_text
-
-    def _display_clean(self):
+    def _display_clean(self, sleep: bool = True):
         """cleans the display
+
+        Args:
+            sleep (bool, optional): put the panel back to sleep afterwards. Defaults to True.
         """
         try:
-            if self.config.get('DEFAULT', 'model') == 'inky':
-                inky = self.inky_auto()
-                for _ in range(2):
-                    for y in range(inky.height - 1):
-                        for x in range(inky.width - 1):
-                            inky.set_pixel(x, y, self.inky_clean)
-
-                    inky.show()
-                    time.sleep(1.0)
-            if self.config.get('DEFAULT', 'model') == 'waveshare4':
-                epd = self.wave4.EPD()
-                epd.init()
-                epd.Clear()
-            self.current_view = ViewState.CLEAN
+            self.display.wake()
+            self.display.clean()
+            if sleep:
+                self.display.sleep()
+            self.last_frame.clear()
         except Exception as e:
             self.logger.error(f'Display clean error: {e}')
             self.logger.error(traceback.format_exc())
 
-    def _convert_image_wave(self, img: Image, saturation: int = 2) -> Image:
-        # blow out the saturation
-        converter = ImageEnhance.Color(img)
-        img = converter.enhance(saturation)
-        # dither to 7-color palette
-        palette_data = [0x00, 0x00, 0x00,
-                        0xff, 0xff, 0xff,
-                        0x00, 0xff, 0x00,
-                        0x00, 0x00, 0xff,
-                        0xff, 0x00, 0x00,
-                        0xff, 0xff, 0x00,
-                        0xff, 0x80, 0x00]
-        # Image size doesn't matter since it's just the palette we're using
-        palette_image = Image.new('P', (1, 1))
-        # Set our 7 color palette (+ clear) and zero out the other 247 colors
-        palette_image.putpalette(palette_data + [0, 0, 0] * 248)
-        # Force source image and palette data to be loaded for `.im` to work
-        img.load()
-        palette_image.load()
-        im = img.im.convert('P', True, palette_image.im)
-        # create the new 7 color image and return it
-        return img._new(im)
-
-    def _display_image(self, image: Image, saturation: float = 0.5):
-        """displays a image on the inky display
+    def _display_frame(self, frame) -> bool:
+        """displays a packed frame on the display, unless the same frame is already shown
 
         Args:
-            image (Image): Image to display
-            saturation (float, optional): saturation. Defaults to 0.5.
+            frame: frame buffer produced by the display backend
+
+        Returns:
+            bool: True if the panel was refreshed
         """
         try:
-            if self.config.get('DEFAULT', 'model') == 'inky':
-                inky = self.inky_auto()
-                inky.set_image(image, saturation=saturation)
-                inky.show()
-            if self.config.get('DEFAULT', 'model') == 'waveshare4':
-                epd = self.wave4.EPD()
-                epd.init()
-                epd.display(epd.getbuffer(self._convert_image_wave(image)))
-                epd.sleep()
+            digest = frame_digest(frame)
+            if self.last_frame.is_on_display(digest):
+                self.logger.info(f'Frame unchanged, skipping refresh ({self.last_frame.skipped} skipped so far)')
+                self.display.sleep()
+                return False
+            self.display.wake()
+            self.display.show(frame)
+            self.display.sleep()
+            self.last_frame.update(digest)
+            return True
         except Exception as e:
             self.logger.error(f'Display image error: {e}')
             self.logger.error(traceback.format_exc())
+            return False
+
+    def _open_cover(self, source) -> Image:
+        """decodes a cover no larger than _gen_pic needs, 'repeat' tiles the image as is so it is decoded in full
+
+        Args:
+            source: path or file object of the cover
+        """
+        if self.profile.background_mode != 'fit':
+            return open_cover(source)
+        small_cover_px = self.profile.album_cover_small_px if self.profile.album_cover_small else 0
+        return open_cover(source, (self.profile.width, self.profile.height), small_cover_px)
 
     def _gen_pic(self, image: Image, artist: str, title: str) -> Image:
         """Generates the Picture for the display
@@ -234,74 +218,49 @@ class ShazampiEinkDisplay:
         Returns:
             Image: The finished image
         """
-        album_cover_small_px = self.config.getint('DEFAULT', 'album_cover_small_px')
-        offset_px_left = self.config.getint('DEFAULT', 'offset_px_left')
-        offset_px_right = self.config.getint('DEFAULT', 'offset_px_right')
-        offset_px_top = self.config.getint('DEFAULT', 'offset_px_top')
-        offset_px_bottom = self.config.getint('DEFAULT', 'offset_px_bottom')
-        offset_text_px_shadow = self.config.getint('DEFAULT', 'offset_text_px_shadow')
-        text_direction = self.config.get('DEFAULT', 'text_direction')
+        profile = self.profile
         # The width and height of the background
         bg_w, bg_h = image.size
-        if self.config.get('DEFAULT', 'background_mode') == 'fit':
-            if bg_w < self.config.getint('DEFAULT', 'width') or bg_w > self.config.getint('DEFAULT', 'width'):
-                image_new = ImageOps.fit(image=image, size=(
-                    self.config.getint('DEFAULT', 'width'), self.config.getint('DEFAULT', 'height')), centering=(0, 0))
+        if profile.background_mode == 'fit':
+            if bg_w < profile.width or bg_w > profile.width:
+                image_new = ImageOps.fit(image=image, size=(profile.width, profile.height), centering=(0, 0))
             else:
                 # no need to expand just crop
-                image_new = image.crop(
-                    (0, 0, self.config.getint('DEFAULT', 'width'), self.config.getint('DEFAULT', 'height')))
-        if self.config.get('DEFAULT', 'background_mode') == 'repeat':
-            if bg_w < self.config.getint('DEFAULT', 'width') or bg_h < self.config.getint('DEFAULT', 'height'):
+                image_new = image.crop((0, 0, profile.width, profile.height))
+        if profile.background_mode == 'repeat':
+            if bg_w < profile.width or bg_h < profile.height:
                 # we need to repeat the background
                 # Creates a new empty image, RGB mode, and size of the display
-                image_new = Image.new('RGB',
-                                      (self.config.getint('DEFAULT', 'width'), self.config.getint('DEFAULT', 'height')))
+                image_new = Image.new('RGB', (profile.width, profile.height))
                 # Iterate through a grid, to place the background tile
-                for x in range(0, self.config.getint('DEFAULT', 'width'), bg_w):
-                    for y in range(0, self.config.getint('DEFAULT', 'height'), bg_h):
+                for x in range(0, profile.width, bg_w):
+                    for y in range(0, profile.height, bg_h):
                         # paste the image at location x, y:
                         image_new.paste(image, (x, y))
             else:
                 # no need to repeat just crop
-                image_new = image.crop(
-                    (0, 0, self.config.getint('DEFAULT', 'width'), self.config.getint('DEFAULT', 'height')))
-        if self.config.getboolean('DEFAULT', 'album_cover_small'):
-            cover_smaller = image.resize([album_cover_small_px, album_cover_small_px], Image.LANCZOS)
-            album_pos_x = (self.config.getint('DEFAULT', 'width') - album_cover_small_px) // 2
-            image_new.paste(cover_smaller, [album_pos_x, offset_px_top])
-        font_title = ImageFont.truetype(self.config.get('DEFAULT', 'font_path'),
-                                        self.config.getint('DEFAULT', 'font_size_title'))
-        font_artist = ImageFont.truetype(self.config.get('DEFAULT', 'font_path'),
-                                         self.config.getint('DEFAULT', 'font_size_artist'))
-        if text_direction == 'top-down':
-            title_position_y = album_cover_small_px + offset_px_top + 10
-            title_height = self._fit_text_top_down(img=image_new, text=title, text_color='white',
-                                                   shadow_text_color='black', font=font_title,
-                                                   font_size=self.config.getint('DEFAULT', 'font_size_title'),
-                                                   y_offset=title_position_y, x_start_offset=offset_px_left,
-                                                   x_end_offset=offset_px_right,
-                                                   offset_text_px_shadow=offset_text_px_shadow)
-            artist_position_y = album_cover_small_px + offset_px_top + 10 + title_height
-            self._fit_text_top_down(img=image_new, text=artist, text_color='white', shadow_text_color='black',
-                                    font=font_artist, font_size=self.config.getint('DEFAULT', 'font_size_artist'),
-                                    y_offset=artist_position_y, x_start_offset=offset_px_left,
-                                    x_end_offset=offset_px_right, offset_text_px_shadow=offset_text_px_shadow)
-        if text_direction == 'bottom-up':
-            artist_position_y = self.config.getint('DEFAULT', 'height') - (
-                    offset_px_bottom + self.config.getint('DEFAULT', 'font_size_artist'))
-            artist_height = self._fit_text_bottom_up(img=image_new, text=artist, text_color='white',
-                                                     shadow_text_color='black', font=font_artist,
-                                                     font_size=self.config.getint('DEFAULT', 'font_size_artist'),
-                                                     y_offset=artist_position_y, x_start_offset=offset_px_left,
-                                                     x_end_offset=offset_px_right,
-                                                     offset_text_px_shadow=offset_text_px_shadow)
-            title_position_y = self.config.getint('DEFAULT', 'height') - (
-                    offset_px_bottom + self.config.getint('DEFAULT', 'font_size_title')) - artist_height
-            self._fit_text_bottom_up(img=image_new, text=title, text_color='white', shadow_text_color='black',
-                                     font=font_title, font_size=self.config.getint('DEFAULT', 'font_size_title'),
-                                     y_offset=title_position_y, x_start_offset=offset_px_left,
-                                     x_end_offset=offset_px_right, offset_text_px_shadow=offset_text_px_shadow)
+                image_new = image.crop((0, 0, profile.width, profile.height))
+        if profile.album_cover_small:
+            cover_smaller = image.resize([profile.album_cover_small_px, profile.album_cover_small_px], Image.LANCZOS)
+            album_pos_x = (profile.width - profile.album_cover_small_px) // 2
+            image_new.paste(cover_smaller, [album_pos_x, profile.offset_px_top])
+        text_style = dict(text_color='white', shadow_text_color='black', x_start_offset=profile.offset_px_left,
+                          x_end_offset=profile.offset_px_right, offset_text_px_shadow=profile.offset_text_px_shadow)
+        if profile.text_direction == 'top-down':
+            title_position_y = profile.album_cover_small_px + profile.offset_px_top + 10
+            title_height = fit_text(img=image_new, text=title, font=profile.font_title,
+                                    font_size=profile.font_size_title, y_offset=title_position_y, **text_style)
+            artist_position_y = profile.album_cover_small_px + profile.offset_px_top + 10 + title_height
+            fit_text(img=image_new, text=artist, font=profile.font_artist, font_size=profile.font_size_artist,
+                     y_offset=artist_position_y, **text_style)
+        if profile.text_direction == 'bottom-up':
+            artist_position_y = profile.height - (profile.offset_px_bottom + profile.font_size_artist)
+            artist_height = fit_text(img=image_new, text=artist, font=profile.font_artist,
+                                     font_size=profile.font_size_artist, y_offset=artist_position_y,
+                                     bottom_up=True, **text_style)
+            title_position_y = profile.height - (profile.offset_px_bottom + profile.font_size_title) - artist_height
+            fit_text(img=image_new, text=title, font=profile.font_title, font_size=profile.font_size_title,
+                     y_offset=title_position_y, bottom_up=True, **text_style)
         return image_new
 
     def _display_update_process(self, song_info: SongInfo = None, weather_info=None):
@@ -312,26 +271,42 @@ class ShazampiEinkDisplay:
             int: updated picture refresh counter
         """
         if song_info:
-            # download cover
-            image = self._gen_pic(Image.open(requests.get(song_info.album_art, stream=True).raw), song_info.artist,
-                                  song_info.title)
+            cache_key = self.frame_cache.key(song_info.title, song_info.artist, song_info.album_art)
+            cached_frame = self.frame_cache.get(cache_key)
+            if cached_frame is not None:
+                # known track, no download, render or dithering needed
+                frame = self.display.frame_from_buffer(cached_frame)
+            else:
+                if song_info.album_art_data is not None:
+                    # fetched together with the match
+                    cover = io.BytesIO(song_info.album_art_data)
+                else:
+                    # download cover
+                    cover = requests.get(song_info.album_art, stream=True, timeout=(3.05, 10)).raw
+                image = self._gen_pic(self._open_cover(cover), song_info.artist, song_info.title)
+                frame = self.display.pack(image)
+                self.frame_cache.put(cache_key, frame)
         elif weather_info:
 
             # not song playing use logo + weather info
-            image = self._gen_pic(Image.open(self.config.get('DEFAULT', 'no_song_cover')),
-                                  weather_info['weather_sub_description'],
-                                  weather_info['temperature'])
+            frame = self.display.pack(self._gen_pic(self._open_cover(self.profile.no_song_cover),
+                                                    weather_info['weather_sub_description'],
+                                                    weather_info['temperature']))
         else:
             # not song playing use logo
-            image = self._gen_pic(Image.open(self.config.get('DEFAULT', 'no_song_cover')), 'shazampi-eink',
-                                  'No song playing')
+            frame = self.display.pack(self._gen_pic(self._open_cover(self.profile.no_song_cover),
+                                                    'shazampi-eink', 'No song playing'))
         # clean screen every x pics
-        if self.pic_counter > self.config.getint('DEFAULT', 'display_refresh_counter'):
-            self._display_clean()
+        if self.pic_counter > self.profile.display_refresh_counter:
+            self._display_clean(sleep=False)
             self.pic_counter = 0
         # display picture on display
-        self._display_image(image)
-        self.pic_counter += 1
+        if self._display_frame(frame):
+            self.pic_counter += 1
+
+    def _submit_display_update(self, **kwargs):
+        """queues a display update on the display worker, a newer update replaces a pending one"""
+        self.display_worker.submit(functools.partial(self._display_update_process, **kwargs))
 
     def _get_song_info(self, raw_audio) -> SongInfo:
         """get the currently playing song
@@ -339,90 +314,243 @@ class ShazampiEinkDisplay:
         Returns:
             SongInfo: with song name, album cover url, artist's name's
         """
-        wav_audio = self.audio_service.convert_audio_to_wav_format(raw_audio)
-        song_info_dict = self.shazam_service.identify_song(wav_audio)
+        pcm_audio = self.audio_service.encode_pcm16(raw_audio)
+        song_info_dict = self.shazam_service.identify_song(pcm_audio)
         if song_info_dict:
             logging.debug("found song")
             return SongInfo(title=song_info_dict['title'],
                             artist=song_info_dict['artist'],
                             album_art=song_info_dict['album_art'],
                             song_duration=song_info_dict['song_duration'],
-                            offset=song_info_dict['offset'])
+                            offset=song_info_dict['offset'],
+                            album_art_data=song_info_dict.get('album_art_data'))
         else:
             logging.debug("couldn't identify the music")
 
+    def _detect_music(self, raw_audio):
+        """runs the audio gate and the music model on a window that is not normalized yet
+
+        Args:
+            raw_audio: 16 kHz window as captured
+
+        Returns:
+            tuple: whether music is playing, and the normalized window or None if the gate skipped the model
+        """
+        if self.audio_gate is not None and not self.audio_gate.should_run_model(raw_audio):
+            is_music_playing, audio = self.music_detector.skip(), None
+        else:
+            audio = self.audio_service.normalize(raw_audio)
+            is_music_playing = self.music_detector.is_audio_music(audio)
+            if self.audio_gate is not None:
+                self.audio_gate.learn(is_music_playing)
+        self._report_startup()
+        return is_music_playing, audio
+
+    def _detect_music_incremental(self, window_end):
+        """runs the audio gate and the music model on the samples of the streamed window ending at
+        window_end that earlier hops have not seen, normalized to the peak of the whole window
+
+        Args:
+            window_end (int): stream position where the window ends
+
+        Returns:
+            tuple: whether music is playing, and a callable returning the normalized window or None if the
+                gate skipped the model
+        """
+        ring_buffer = self.audio_service.ring_buffer
+        length = int(self.recording_duration * self.audio_service.down_sampled_rate)
+        window_start = window_end - length
+        new_start = self.music_detector.pending_start(window_start)
+        if self.audio_gate is not None:
+            new_start = min(new_start, self.audio_gate.pending_start(window_start))
+        new_audio = ring_buffer.read(window_end, window_end - max(new_start, window_start))
+        if self.audio_gate is not None and not self.audio_gate.should_run_model(new_audio, window_end, length):
+            is_music_playing, load_audio = self.music_detector.skip(), None
+        else:
+            peak = ring_buffer.peak(window_end, length)
+            is_music_playing = self.music_detector.update(self.audio_service.normalize(new_audio, peak),
+                                                          window_end, length)
+            if self.audio_gate is not None:
+                self.audio_gate.learn(is_music_playing)
+
+            def load_audio():
+                return self.audio_service.normalize(ring_buffer.read(window_end, length), peak)
+        self._report_startup()
+        return is_music_playing, load_audio
+
+    def _report_startup(self):
+        if not self.startup_reported:
+            self.startup.milestone('first detection')
+            self.logger.info('Startup timing (start, duration):\n' + '\n'.join(self.startup.report()))
+            self.startup_reported = True
+
+    def _on_window(self, is_music_playing, embedding=None, load_audio=None, captured_at=None):
+        """decides whether to identify the song and which view to show after a classified window
+
+        Args:
+            is_music_playing (bool): music decision for the window
+            embedding: YAMNet embedding of the window, None if the model did not run
+            load_audio (callable, optional): returns the normalized window, None if it went unclassified
+            captured_at (float, optional): scheduler clock time the window's capture ended, defaults to now
+        """
+        self.scheduler.observe(is_music_playing)
+        if is_music_playing:
+            # music is playing but check if we should re-trigger shazam
+            #   music was stopped in previous iteration i.e !was_music_playing
+            #   OR
+            #   the scheduler predicts the song has ended (or a retry is due)
+            due = not self.was_music_playing or self.scheduler.is_due()
+            identify = due
+            if self.song_change is not None:
+                # the embedding can call Shazam early on a new song or skip it for the same one,
+                # early at most once per scheduler min_interval since windows arrive every hop
+                identify = self.song_change.should_identify(embedding, due, self.scheduler.may_call_early())
+            if identify and load_audio is not None:
+                self.logger.debug("music detected, identifying....")
+                # music detected, identify using shazam
+                # the song's position is anchored at the end of the capture, not at when Shazam got to it
+                window_end = self.scheduler.clock() if captured_at is None else captured_at
+                song_info = self._get_song_info(load_audio())
+
+                if song_info:
+                    self.logger.debug("identified....")
+                    self.scheduler.on_match(song_info.offset, song_info.song_duration, window_end)
+                else:
+                    self.logger.debug("couldn't identify the song")
+                    self.scheduler.on_miss()
+
+                self.logger.debug(f"won't re-identify for {self.scheduler.seconds_until_due():.0f} seconds "
+                                  f"({self.scheduler.calls} Shazam calls, {self.scheduler.saved_calls} saved "
+                                  f"compared to identifying every {self.delay} seconds)")
+                if self.song_change is not None:
+                    self.song_change.remember(embedding if song_info else None)
+
+                if song_info and song_info.title != self.prev_song_title:
+                    self._submit_display_update(song_info=song_info)
+                    self.current_view = ViewState.PLAYING
+                    self.prev_song_title = song_info.title
+            elif due and load_audio is not None:
+                self.scheduler.on_same_song()
+                self.logger.debug(f"same song still playing (embedding distance "
+                                  f"{self.song_change.last_distance:.3f}), skipped Shazam "
+                                  f"({self.song_change.skipped} skipped so far)")
+            self.was_music_playing = True
+        else:
+            if self.was_music_playing:
+                self.logger.debug("music stopped...")
+            self.was_music_playing = False
+
+        if not self.was_music_playing and self.scheduler.idle():
+            # nothing playing to set display to NO SONG view
+
+            # no need to reset everytime
+            if self.current_view != ViewState.NOTHING_PLAYING:
+                self._submit_display_update(weather_info=self.weather_info)
+                self.prev_song_title = None
+                if self.song_change is not None:
+                    self.song_change.remember(None)
+
+            # weather data outdated after 30 min, update
+            elif datetime.datetime.now() - self.weather_info['fetched_at'] >= datetime.timedelta(minutes=30):
+                self.weather_info = self.weather_service.get_weather_data()
+                self._submit_display_update(weather_info=self.weather_info)
+                self.current_view = ViewState.NOTHING_PLAYING
+
+            self.current_view = ViewState.NOTHING_PLAYING
+
+    def _run_sequential(self):
+        """capture, classify and identify one window after the other on this thread"""
+        while True:
+            try:
+                if self.incremental_detection:
+                    # re-decide every YAMNet hop, only the newest samples are gated and go through the model
+                    window_end = self.audio_service.next_window_end(self.recording_duration, hop=PATCH_HOP_SECONDS)
+                elif self.settings.streaming_capture:
+                    raw_audio = self.audio_service.next_window(self.recording_duration, normalize=False)
+                else:
+                    raw_audio = self.audio_service.record_raw_audio(self.recording_duration, normalize=False)
+                captured_at = self.scheduler.clock()
+                if self.music_detector is None:
+                    self.startup.milestone('first window')
+                    self._finish_startup()
+                if self.incremental_detection:
+                    is_music_playing, load_audio = self._detect_music_incremental(window_end)
+                else:
+                    is_music_playing, audio = self._detect_music(raw_audio)
+                    load_audio = None if audio is None else lambda: audio
+                self._on_window(is_music_playing, self.music_detector.last_embedding, load_audio, captured_at)
+            except Exception as e:
+                self.logger.error(f'Error: {e}')
+                self.logger.error(traceback.format_exc())
+
+    def _run_pipeline(self):
+        """runs capture, inference, identification and rendering as stages on their own threads
+
+        The inference queue only carries window end positions, the window is read from the capture ring
+        buffer when inference starts. Inference hands the normalized window on to the identification stage.
+        The inference queue drops a window that has not started yet when a newer one arrives,
+        the identification queue blocks the inference while Shazam is busy.
+        """
+        self._finish_startup()
+        ring_buffer = self.audio_service.ring_buffer
+        length = int(self.recording_duration * self.audio_service.down_sampled_rate)
+
+        def infer(window_end, captured_at):
+            # the normalized window travels with the result, a queued item can wait behind a Shazam call
+            # for longer than the ring buffer holds the audio
+            if self.incremental_detection:
+                is_music_playing, load_audio = self._detect_music_incremental(window_end)
+                # only a window with music can be identified, skip the copy of the others
+                audio = load_audio() if is_music_playing and load_audio is not None else None
+            else:
+                is_music_playing, audio = self._detect_music(ring_buffer.read(window_end, length))
+            return is_music_playing, self.music_detector.last_embedding, audio
+
+        def identify(result, captured_at):
+            is_music_playing, embedding, audio = result
+            self._on_window(is_music_playing, embedding, None if audio is None else lambda: audio, captured_at)
+
+        inference = PipelineStage('inference', infer)
+        pipeline = Pipeline(inference, PipelineStage('identification', identify)).start()
+        hop = PATCH_HOP_SECONDS if self.incremental_detection else None
+        report_at = time.monotonic() + PIPELINE_REPORT_SECONDS
+        while True:
+            inference.offer(self.audio_service.next_window_end(self.recording_duration, hop))
+            if time.monotonic() >= report_at:
+                report_at += PIPELINE_REPORT_SECONDS
+                render_depth = int(self.display_worker.busy)
+                self.logger.info('Pipeline stages:\n' + '\n'.join(
+                    pipeline.report() + [self.display_worker.metrics.summary(render_depth)]))
+
     def start(self):
         self.logger.info('Service started')
-        # clean screen initially
-        self._display_clean()
-        prev_song_title = None
-        weather_info = self.weather_service.get_weather_data()
-        was_music_playing = False
-        last_music_detection_time = datetime.datetime.now()
-        song_end_duration_left = self.delay
+        self.startup.milestone('service loop')
+        # clean screen initially, unless we know which frame is still on the glass from the last run
+        if self.last_frame.last_digest is None:
+            self.display_worker.submit(self._display_clean)
+            self.current_view = ViewState.CLEAN
+        self._weather_loading = self.startup.background('weather', self.weather_service.get_weather_data)
+        if self.settings.streaming_capture:
+            # keep the microphone running while we classify, identify and draw
+            with self.startup.step('audio stream'):
+                self.audio_service.start_stream()
+        self.prev_song_title = None
+        self.was_music_playing = False
+        # no music for a minute from here on shows the idle view
+        # same clock as the pipeline's capture times
+        self.scheduler = IdentificationScheduler(recording_duration=self.recording_duration,
+                                                 fallback_interval=self.delay, clock=time.perf_counter)
         try:
-            while True:
-                try:
-                    raw_audio = self.audio_service.record_raw_audio(self.recording_duration)
-                    is_music_playing = self.music_detector.is_audio_music(raw_audio)
-                    if is_music_playing:
-                        # music is playing but check if we should re-trigger shazam
-                        #   music was stopped in previous iteration i.e !was_music_playing
-                        #   OR
-                        #   song_info is outdated
-                        if not was_music_playing or datetime.datetime.now() - last_music_detection_time >= datetime.timedelta(
-                                seconds=song_end_duration_left):
-                            self.logger.debug("music detected, identifying....")
-                            # music detected, identify using shazam
-                            song_info = self._get_song_info(raw_audio)
-
-                            if song_info:
-                                self.logger.debug("identified....")
-                                # update remaining time to wait for next re-identify
-                                if song_info.song_duration is None or song_info.offset is None:
-                                    song_end_duration_left = self.delay
-                                else:
-                                    song_end_duration_left = max(self.delay,
-                                                                 song_info.song_duration-song_info.offset-self.recording_duration)
-                            else:
-                                self.logger.debug("couldn't identify the song")
-                                song_end_duration_left = 30  # couldn't identify song so retry in 30 sec
-
-                            self.logger.debug(f"won't re-identify for {song_end_duration_left} seconds")
-
-                            if song_info and song_info.title != prev_song_title:
-                                self._display_update_process(song_info=song_info)
-                                self.current_view = ViewState.PLAYING
-                                prev_song_title = song_info.title
-                            last_music_detection_time = datetime.datetime.now()
-                        was_music_playing = True
-                    else:
-                        if was_music_playing:
-                            self.logger.debug("music stopped...")
-                        was_music_playing = False
-
-                    if (not was_music_playing
-                            and datetime.datetime.now() - last_music_detection_time >= datetime.timedelta(minutes=1)):
-                        # nothing playing to set display to NO SONG view
-
-                        # no need to reset everytime
-                        if self.current_view != ViewState.NOTHING_PLAYING:
-                            self._display_update_process(weather_info=weather_info)
-                            prev_song_title = None
-
-                        # weather data outdated after 30 min, update
-                        elif datetime.datetime.now() - weather_info['fetched_at'] >= datetime.timedelta(minutes=30):
-                            weather_info = self.weather_service.get_weather_data()
-                            self._display_update_process(weather_info=weather_info)
-                            self.current_view = ViewState.NOTHING_PLAYING
-
-                        self.current_view = ViewState.NOTHING_PLAYING
-
-                except Exception as e:
-                    self.logger.error(f'Error: {e}')
-                    self.logger.error(traceback.format_exc())
+            if self.settings.pipeline and self.settings.streaming_capture:
+                self._run_pipeline()
+            else:
+                self._run_sequential()
         except KeyboardInterrupt:
             self.logger.info('Service stopping')
+            self.audio_service.stop_stream()
+            if self.shazam_service is not None:
+                self.shazam_service.close()
+            self.display.close()
             sys.exit(0)
 
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the service imports its modules relative to python/, like shazampiEinkDisplay.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from service.audio_gate import NOISE, PASSED, SILENT, AudioGate
+
+SAMPLE_RATE = 16000
+
+
+def _at_level(samples, dbfs):
+    return (samples * 10 ** (dbfs / 20) / np.sqrt(np.mean(np.square(samples)))).astype(np.float32)
+
+
+def _music(dbfs, seconds=2, seed=0):
+    """A few sustained tones with a slow amplitude swell, steady enough for the gate to call it one level."""
+    t = np.arange(seconds * SAMPLE_RATE) / SAMPLE_RATE
+    tones = sum(np.sin(2 * np.pi * f * t + seed) for f in (220, 277, 330, 440))
+    return _at_level(tones * (1 + 0.3 * np.sin(2 * np.pi * 0.5 * t)), dbfs)
+
+
+def _hiss(dbfs, seconds=2, seed=0):
+    return _at_level(np.random.default_rng(seed).standard_normal(seconds * SAMPLE_RATE), dbfs)
+
+
+def test_quiet_song_at_startup_is_passed():
+    gate = AudioGate()
+    decisions = [gate.check(_music(-45, seed=i)) for i in range(6)]
+    assert decisions == [PASSED] * 6
+
+
+def test_song_below_old_floor_levels_is_passed():
+    for dbfs in (-42, -48, -52):
+        gate = AudioGate()
+        assert [gate.check(_music(dbfs, seed=i)) for i in range(6)] == [PASSED] * 6
+
+
+def test_absolute_silence_is_silent():
+    assert AudioGate().check(_music(-70)) == SILENT
+
+
+def test_room_level_becomes_floor_after_model_rejects_it():
+    gate = AudioGate()
+    room = [_music(-50, seed=i) for i in range(4)]
+    for window in room[:3]:
+        assert gate.check(window) == PASSED
+        gate.learn(is_music=False)
+    assert gate.noise_floor_db > -52
+    assert gate.check(room[3]) == SILENT
+    # a song well above the room is still passed
+    assert gate.check(_music(-35)) == PASSED
+
+
+def test_music_resets_floor_learning():
+    gate = AudioGate()
+    for is_music in (False, False, True, False, False):
+        gate.check(_music(-50))
+        gate.learn(is_music)
+    assert gate.noise_floor_db == gate.silence_dbfs
+
+
+def test_floor_never_rises_above_ceiling():
+    gate = AudioGate()
+    for i in range(3):
+        gate.check(_music(-20, seed=i))
+        gate.learn(is_music=False)
+    assert gate.noise_floor_db == gate.floor_ceiling_dbfs
+    assert gate.check(_music(-30)) == PASSED
+
+
+def test_broadband_hiss_is_noise():
+    assert AudioGate().check(_hiss(-30)) == NOISE
+
+
+def test_streamed_update_matches_whole_window_check():
+    stream = np.concatenate([_music(-45, seed=i) for i in range(3)] + [_hiss(-30, seed=i) for i in range(3)])
+    length, hop = 64 * 1024, 8 * 1024
+    streamed, whole = AudioGate(), AudioGate()
+    for window_end in range(length, len(stream) + 1, hop):
+        # only the samples the gate has not seen yet are handed over
+        new_start = max(streamed.pending_start(window_end - length), window_end - length)
+        assert streamed.update(stream[new_start:window_end], window_end, length) == whole.check(
+            stream[window_end - length:window_end])
+        assert streamed.last_features == pytest.approx(whole.last_features)
+    assert streamed.counters == whole.counters and streamed.counters[NOISE] > 0
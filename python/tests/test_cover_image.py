@@ -0,0 +1,30 @@
+import io
+import logging
+
+from PIL import Image
+
+from service.cover_image import draft_size, open_cover
+
+
+def jpeg(size):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 40, 40)).save(buffer, 'JPEG')
+    buffer.seek(0)
+    return buffer
+
+
+def test_draft_size_covers_panel_and_small_cover():
+    assert draft_size((3000, 3000), (640, 400)) == (640, 640)
+    assert draft_size((3000, 1500), (640, 400), small_cover_px=500) == (800, 500)
+
+
+def test_jpeg_is_decoded_at_the_smallest_covering_scale(caplog):
+    with caplog.at_level(logging.INFO, logger='service.cover_image'):
+        image = open_cover(jpeg((3000, 3000)), (640, 400))
+    # 1/4 is 750x750, 1/8 would be 375x375 and no longer cover 640x640
+    assert image.size == (750, 750)
+    assert 'pixel buffer 1.61 MiB (at full size 25.75 MiB)' in caplog.text
+
+
+def test_without_panel_size_the_full_image_is_decoded():
+    assert open_cover(jpeg((1200, 800))).size == (1200, 800)
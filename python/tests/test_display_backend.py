@@ -0,0 +1,81 @@
+import importlib
+import sys
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from service.display_backend import VirtualBackend, Waveshare4Backend, blend_palette
+from service.quantizer import ACEP_PALETTE_RGB, NO_DITHER, color_indices, unpack_indices
+
+# inky_uc8159's public palettes, the last entry is the CLEAN color
+SATURATED = [[57, 48, 57], [255, 255, 255], [58, 91, 70], [61, 59, 94], [156, 72, 75], [208, 190, 71],
+             [177, 106, 73], [255, 255, 255]]
+DESATURATED = [[0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255], [255, 0, 0], [255, 255, 0], [255, 140, 0],
+               [255, 255, 255]]
+
+
+def driver_palette_blend(saturation):
+    """inky's Inky._palette_blend(saturation) for the uint8 palette."""
+    palette = []
+    for i in range(7):
+        rs, gs, bs = [c * saturation for c in SATURATED[i]]
+        rd, gd, bd = [c * (1.0 - saturation) for c in DESATURATED[i]]
+        palette += [int(rs + rd), int(gs + gd), int(bs + bd)]
+    return palette
+
+
+def test_blend_matches_driver():
+    for saturation in (0.0, 0.25, 0.5, 0.8, 1.0):
+        assert blend_palette(SATURATED, DESATURATED, saturation) == driver_palette_blend(saturation)
+
+
+def test_blend_drops_clean_entry():
+    assert len(blend_palette(SATURATED, DESATURATED, 0.5)) == 7 * 3
+
+
+def test_virtual_frames_unpack_to_the_packed_indices(tmp_path):
+    backend = VirtualBackend(16, 4, str(tmp_path), refresh_seconds=0, dither=NO_DITHER, saturation=1)
+    indices = np.random.default_rng(0).integers(0, len(ACEP_PALETTE_RGB), (4, 16)).astype(np.uint8)
+    image = Image.fromarray(np.asarray(ACEP_PALETTE_RGB, dtype=np.uint8)[indices])
+    frame = backend.pack(image)
+    assert (unpack_indices(frame, 16, 4) == indices).all()
+    assert (color_indices(np.asarray(image)) == indices).all()
+
+
+@pytest.fixture
+def epdconfig_calls():
+    """Replaces the GPIO / SPI layer of the Waveshare driver with one that records module setup."""
+    calls = []
+    config = types.ModuleType('lib.epdconfig')
+    config.RST_PIN, config.DC_PIN, config.BUSY_PIN, config.CS_PIN = 17, 25, 24, 8
+    config.module_init = lambda: calls.append('module_init') or 0
+    config.module_exit = lambda: calls.append('module_exit')
+    config.digital_write = config.delay_ms = config.spi_writebyte = config.spi_writebyte2 = lambda *args: None
+    config.digital_read = lambda pin: 1
+    saved = {name: sys.modules.get(name) for name in ('lib.epdconfig', 'lib.epd4in01f')}
+    sys.modules['lib.epdconfig'] = config
+    sys.modules.pop('lib.epd4in01f', None)
+    importlib.import_module('lib.epd4in01f')
+    try:
+        yield calls
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+def test_waveshare_sets_up_gpio_and_spi_once(epdconfig_calls):
+    backend = Waveshare4Backend()
+    backend._epd.ReadBusyHigh = backend._epd.ReadBusyLow = lambda: None
+    for _ in range(3):
+        frame = backend.pack(Image.new('RGB', (640, 400), 'red'))
+        backend.wake()
+        backend.show(frame)
+        backend.sleep()
+    assert epdconfig_calls == ['module_init']
+    backend.close()
+    assert epdconfig_calls == ['module_init', 'module_exit']
@@ -0,0 +1,92 @@
+import importlib
+import sys
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+
+@pytest.fixture(scope='module')
+def epd():
+    # epdconfig talks to the GPIO / SPI hardware on import, the packer does not need it
+    config = types.ModuleType('lib.epdconfig')
+    config.RST_PIN, config.DC_PIN, config.BUSY_PIN, config.CS_PIN = 17, 25, 24, 8
+    saved = {name: sys.modules.get(name) for name in ('lib.epdconfig', 'lib.epd4in01f')}
+    sys.modules['lib.epdconfig'] = config
+    sys.modules.pop('lib.epd4in01f', None)
+    try:
+        yield importlib.import_module('lib.epd4in01f').EPD()
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+def reference_color(pixel):
+    Color = 0
+    if (pixel[0] == 0 and pixel[1] == 0 and pixel[2] == 0):
+        Color = 0
+    elif (pixel[0] == 255 and pixel[1] == 255 and pixel[2] == 255):
+        Color = 1
+    elif (pixel[0] == 0 and pixel[1] == 255 and pixel[2] == 0):
+        Color = 2
+    elif (pixel[0] == 0 and pixel[1] == 0 and pixel[2] == 255):
+        Color = 3
+    elif (pixel[0] == 255 and pixel[1] == 0 and pixel[2] == 0):
+        Color = 4
+    elif (pixel[0] == 255 and pixel[1] == 255 and pixel[2] == 0):
+        Color = 5
+    elif (pixel[0] == 255 and pixel[1] == 128 and pixel[2] == 0):
+        Color = 6
+    return Color
+
+
+def reference_getbuffer(epd, image):
+    """The per-pixel loop EPD.getbuffer used before it was vectorized."""
+    buf = [0x00] * int(epd.width * epd.height / 2)
+    image_monocolor = image.convert('RGB')
+    imwidth, imheight = image_monocolor.size
+    pixels = image_monocolor.load()
+    if imwidth == epd.width and imheight == epd.height:
+        for y in range(imheight):
+            for x in range(imwidth):
+                Add = int((x + y * epd.width) / 2)
+                Color = reference_color(pixels[x, y])
+                data_t = buf[Add] & (~(0xF0 >> ((x % 2) * 4)))
+                buf[Add] = data_t | ((Color << 4) >> ((x % 2) * 4))
+    elif imwidth == epd.height and imheight == epd.width:
+        for y in range(imheight):
+            for x in range(imwidth):
+                newx = y
+                newy = epd.height - x - 1
+                Add = int((newx + newy * epd.width) / 2)
+                Color = reference_color(pixels[x, y])
+                data_t = buf[Add] & (~(0xF0 >> ((newx % 2) * 4)))
+                buf[Add] = data_t | ((Color << 4) >> ((newx % 2) * 4))
+    return buf
+
+
+def random_frame(width, height, seed):
+    """Palette colors mixed with off-palette pixels, which both versions map to black."""
+    rng = np.random.default_rng(seed)
+    palette = np.array([(0, 0, 0), (255, 255, 255), (0, 255, 0), (0, 0, 255), (255, 0, 0),
+                        (255, 255, 0), (255, 128, 0)], dtype=np.uint8)
+    pixels = palette[rng.integers(0, len(palette), (height, width))]
+    off_palette = rng.random((height, width)) < 0.1
+    pixels[off_palette] = rng.integers(0, 256, (int(off_palette.sum()), 3), dtype=np.uint8)
+    return Image.fromarray(pixels, 'RGB')
+
+
+@pytest.mark.parametrize('orientation', ['landscape', 'portrait'])
+def test_getbuffer_matches_reference_loop(epd, orientation):
+    size = (epd.width, epd.height) if orientation == 'landscape' else (epd.height, epd.width)
+    image = random_frame(*size, seed=size[0])
+    assert bytes(epd.getbuffer(image)) == bytes(reference_getbuffer(epd, image))
+
+
+def test_getbuffer_unexpected_size_is_blank(epd):
+    image = random_frame(epd.width // 2, epd.height // 2, seed=1)
+    assert bytes(epd.getbuffer(image)) == bytes(reference_getbuffer(epd, image))
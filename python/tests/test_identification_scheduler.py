@@ -0,0 +1,112 @@
+import pytest
+
+from service.identification_scheduler import IdentificationScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_match_schedules_just_after_predicted_song_end(clock):
+    scheduler = IdentificationScheduler(recording_duration=10, boundary_margin=5, clock=clock)
+    clock.now = 100.0
+    # the window started 30 s into a 200 s song, so it ended at 40 s and 160 s are left
+    scheduler.on_match(offset=30, duration=200)
+    assert scheduler.position() == pytest.approx(40)
+    assert scheduler.seconds_until_due() == pytest.approx(165)
+    clock.now = 264.0
+    assert not scheduler.is_due()
+    clock.now = 265.0
+    assert scheduler.is_due()
+
+
+def test_match_anchors_at_capture_time_not_identification_time(clock):
+    scheduler = IdentificationScheduler(recording_duration=10, boundary_margin=5, clock=clock)
+    clock.now = 104.0
+    # identification ran 4 s after the window was captured, e.g. queued behind another call
+    scheduler.on_match(offset=30, duration=200, window_end=100.0)
+    assert scheduler.position() == pytest.approx(44)
+    assert scheduler.seconds_until_due() == pytest.approx(161)
+
+
+def test_match_near_song_end_waits_min_interval(clock):
+    scheduler = IdentificationScheduler(recording_duration=10, min_interval=10, clock=clock)
+    scheduler.on_match(offset=195, duration=200)
+    assert scheduler.seconds_until_due() == pytest.approx(10)
+
+
+@pytest.mark.parametrize('offset, duration', [(None, 200), (30, None), ({}, 200)])
+def test_match_without_offset_or_duration_falls_back(clock, offset, duration):
+    scheduler = IdentificationScheduler(fallback_interval=120, clock=clock)
+    scheduler.on_match(offset, duration)
+    assert scheduler.seconds_until_due() == pytest.approx(120)
+
+
+def test_misses_back_off_up_to_cap(clock):
+    scheduler = IdentificationScheduler(retry_interval=30, max_retry_interval=480, clock=clock)
+    waits = []
+    for _ in range(7):
+        scheduler.on_miss()
+        waits.append(scheduler.seconds_until_due())
+    assert waits == [30, 60, 120, 240, 480, 480, 480]
+    scheduler.on_match(offset=0, duration=200)
+    assert scheduler.misses_in_row == 0
+    scheduler.on_miss()
+    assert scheduler.seconds_until_due() == 30
+
+
+def test_same_song_postpones_by_named_interval(clock):
+    scheduler = IdentificationScheduler(same_song_interval=45, clock=clock)
+    calls = scheduler.calls
+    scheduler.on_same_song()
+    assert scheduler.seconds_until_due() == 45
+    assert scheduler.calls == calls
+
+
+def test_idle_counts_from_last_music(clock):
+    scheduler = IdentificationScheduler(idle_after=60, clock=clock)
+    clock.now = 30.0
+    scheduler.observe(True)
+    clock.now = 35.0
+    scheduler.observe(False)
+    clock.now = 89.0
+    assert not scheduler.idle()
+    clock.now = 90.0
+    assert scheduler.idle()
+    scheduler.observe(True)
+    assert not scheduler.idle()
+
+
+def test_saved_calls_against_fixed_interval(clock):
+    scheduler = IdentificationScheduler(recording_duration=10, fallback_interval=120, clock=clock)
+    # 20 minutes of music in 5 s windows, one 300 s song after the other
+    while clock.now < 1200:
+        scheduler.observe(True)
+        if scheduler.is_due():
+            scheduler.on_match(offset=clock.now % 300, duration=300, window_end=clock.now)
+        clock.now += 5
+    # the fixed policy calls when music starts and then every 120 s: 1 + 1195 / 120
+    assert scheduler.saved_calls == int(1 + 1195 / 120) - scheduler.calls
+    assert scheduler.calls < int(1 + 1195 / 120)
+
+
+def test_early_call_waits_for_min_interval_after_last_call(clock):
+    scheduler = IdentificationScheduler(min_interval=10, clock=clock)
+    assert scheduler.may_call_early()
+    clock.now = 100.0
+    scheduler.on_match(offset=30, duration=200)
+    clock.now = 109.5
+    assert not scheduler.may_call_early()
+    clock.now = 110.0
+    assert scheduler.may_call_early()
+    scheduler.on_miss()
+    assert not scheduler.may_call_early()
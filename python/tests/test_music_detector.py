@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from service.music_detector import MUSIC_CLASS_INDICES, MusicHysteresis, SongChangeDetector, music_score
+
+N_CLASSES = 521
+BELLS = range(195, 203)
+
+
+def scores(*patches):
+    """One row per patch, each given as {class index: score}."""
+    rows = np.zeros((len(patches), N_CLASSES), dtype=np.float32)
+    for row, patch in zip(rows, patches):
+        for index, value in patch.items():
+            row[index] = value
+    return rows
+
+
+def test_music_classes_skip_the_bell_subtree():
+    assert not set(BELLS) & set(MUSIC_CLASS_INDICES)
+    assert {24, 31, 132, 194, 203, 276} <= set(MUSIC_CLASS_INDICES)
+
+
+def test_score_is_mean_of_strongest_music_class_per_patch():
+    # guitar in the first patch, singing louder than music in the second
+    assert music_score(scores({135: 0.6, 132: 0.2}, {24: 0.8, 132: 0.4})) == pytest.approx(0.7)
+
+
+@pytest.mark.parametrize('bell', BELLS)
+def test_bells_do_not_count_as_music(bell):
+    assert music_score(scores({bell: 0.9, 0: 0.5})) == 0
+
+
+def test_non_music_classes_are_ignored():
+    # speech (0) and dog (69)
+    assert music_score(scores({0: 0.9}, {69: 0.7})) == 0
+
+
+def test_hysteresis_enters_after_one_window_at_threshold():
+    hysteresis = MusicHysteresis(enter_threshold=0.25, exit_threshold=0.15)
+    assert not hysteresis.observe(0.24)
+    assert hysteresis.observe(0.25)
+    assert hysteresis.transitions == 1
+
+
+def test_hysteresis_exits_after_two_windows_below_exit_threshold():
+    hysteresis = MusicHysteresis(enter_threshold=0.25, exit_threshold=0.15)
+    hysteresis.observe(0.5)
+    # between the thresholds keeps the state, one low window is not enough
+    assert [hysteresis.observe(score) for score in (0.2, 0.15, 0.1)] == [True, True, True]
+    assert not hysteresis.observe(0.1)
+    assert hysteresis.transitions == 2
+
+
+def test_hysteresis_exit_streak_resets_on_louder_window():
+    hysteresis = MusicHysteresis(enter_threshold=0.25, exit_threshold=0.15)
+    hysteresis.observe(0.5)
+    assert [hysteresis.observe(score) for score in (0.1, 0.2, 0.1)] == [True, True, True]
+    assert not hysteresis.observe(0.0)
+
+
+def at_distance(reference, distance):
+    """An embedding at cosine distance `distance` from `reference`, scaled to show length does not matter."""
+    other = np.zeros_like(reference)
+    other[1] = 1.0
+    angle = np.arccos(1.0 - distance)
+    return 3.0 * (np.cos(angle) * reference + np.sin(angle) * other)
+
+
+@pytest.fixture
+def detector():
+    detector = SongChangeDetector(changed_distance=0.3, same_distance=0.1, max_skips=3)
+    reference = np.zeros(1024, dtype=np.float32)
+    reference[0] = 2.0
+    detector.remember(reference)
+    return detector
+
+
+@pytest.mark.parametrize('distance, verdict', [
+    (0.0, SongChangeDetector.SAME),
+    (0.09, SongChangeDetector.SAME),
+    (0.11, SongChangeDetector.UNSURE),
+    (0.29, SongChangeDetector.UNSURE),
+    (0.31, SongChangeDetector.CHANGED),
+    (1.0, SongChangeDetector.CHANGED),
+])
+def test_verdict_on_both_sides_of_each_threshold(detector, distance, verdict):
+    assert detector.compare(at_distance(detector.reference, distance)) == verdict
+    assert detector.last_distance == pytest.approx(distance, abs=1e-5)
+
+
+def test_without_reference_the_timer_decides():
+    detector = SongChangeDetector()
+    assert detector.compare(np.ones(4)) == SongChangeDetector.UNSURE
+    assert detector.should_identify(np.ones(4), due=True)
+    assert not detector.should_identify(np.ones(4), due=False)
+
+
+def test_same_song_skips_due_calls_at_most_max_skips_in_a_row(detector):
+    same = at_distance(detector.reference, 0.05)
+    assert [detector.should_identify(same, due=True) for _ in range(4)] == [False, False, False, True]
+    assert detector.skipped == 3
+    # not due: nothing to skip, the streak is unchanged
+    assert not detector.should_identify(same, due=False)
+    assert detector.skipped == 3
+
+
+def test_remember_restarts_the_skip_streak(detector):
+    same = at_distance(detector.reference, 0.05)
+    for _ in range(3):
+        detector.should_identify(same, due=True)
+    detector.remember(detector.reference)
+    assert not detector.should_identify(same, due=True)
+
+
+def test_change_calls_early_only_when_allowed(detector):
+    changed = at_distance(detector.reference, 0.5)
+    assert not detector.should_identify(changed, due=False, may_call_early=False)
+    assert detector.early == 0
+    assert detector.should_identify(changed, due=False, may_call_early=True)
+    assert detector.early == 1
+    # a due call is not early
+    assert detector.should_identify(changed, due=True, may_call_early=False)
+    assert detector.early == 1
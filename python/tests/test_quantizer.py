@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance
+
+from service.quantizer import ACEP_PALETTE_RGB, BAYER, FLOYD_STEINBERG, NO_DITHER, Quantizer
+
+# inky_uc8159's palette blended at saturation 0.5
+INKY_PALETTE = [(28, 24, 28), (255, 255, 255), (29, 173, 35), (30, 29, 174), (205, 36, 37), (231, 222, 35),
+                (216, 123, 36)]
+
+
+def photo(width=64, height=40, seed=0):
+    """Smooth gradients with noise, so dithering has error to diffuse."""
+    y, x = np.mgrid[0:height, 0:width]
+    rgb = np.stack([x * 255 / width, y * 255 / height, (x + y) * 255 / (width + height)], axis=-1)
+    rgb += np.random.default_rng(seed).normal(0, 20, rgb.shape)
+    return Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), 'RGB')
+
+
+def old_waveshare_convert(image, saturation=2):
+    """The conversion Waveshare4Backend used before the shared Quantizer."""
+    image = ImageEnhance.Color(image).enhance(saturation)
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette([c for color in ACEP_PALETTE_RGB for c in color] + [0, 0, 0] * 248)
+    image.load()
+    palette_image.load()
+    return np.asarray(image._new(image.im.convert('P', True, palette_image.im)))
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_floyd_steinberg_matches_old_conversion(seed):
+    image = photo(seed=seed)
+    quantizer = Quantizer(ACEP_PALETTE_RGB, dither=FLOYD_STEINBERG, color_boost=2)
+    assert (quantizer.quantize(image) == old_waveshare_convert(image)).all()
+
+
+@pytest.mark.parametrize('dither', [FLOYD_STEINBERG, BAYER, NO_DITHER])
+def test_indices_stay_inside_palette(dither):
+    indices = Quantizer(INKY_PALETTE, dither=dither).quantize(photo())
+    assert indices.shape == (40, 64) and indices.dtype == np.uint8
+    assert indices.max() < len(INKY_PALETTE)
+
+
+def test_palette_colors_map_to_themselves():
+    image = Image.fromarray(np.asarray(ACEP_PALETTE_RGB, dtype=np.uint8)[np.newaxis])
+    for dither in (FLOYD_STEINBERG, BAYER, NO_DITHER):
+        assert Quantizer(ACEP_PALETTE_RGB, dither=dither, bayer_spread=0).quantize(image).tolist() == [
+            list(range(len(ACEP_PALETTE_RGB)))]
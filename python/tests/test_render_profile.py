@@ -0,0 +1,52 @@
+import configparser
+import os
+
+import pytest
+
+from service.render_profile import RenderProfile
+from service.service_settings import ServiceSettings
+
+RESOURCES = os.path.join(os.path.dirname(__file__), '..', '..', 'resources')
+
+CONFIG = {
+    'width': '640', 'height': '400', 'album_cover_small_px': '200', 'model': 'virtual',
+    'album_cover_small': 'True', 'display_refresh_counter': '20', 'shazampi_log': 'shazampi.log',
+    'no_song_cover': os.path.join(RESOURCES, 'default.jpg'),
+    'font_path': os.path.join(RESOURCES, 'CircularStd-Bold.otf'), 'font_size_title': '45',
+    'font_size_artist': '35', 'offset_px_left': '20', 'offset_px_right': '20', 'offset_px_top': '0',
+    'offset_px_bottom': '20', 'offset_text_px_shadow': '4', 'text_direction': 'bottom-up',
+    'background_mode': 'fit', 'openweathermap_api_key': 'key', 'geo_coordinates': '1, 2', 'units': 'metric',
+}
+
+
+def load(**overrides):
+    config = configparser.ConfigParser()
+    config.read_dict({'DEFAULT': {**CONFIG, **overrides}})
+    return RenderProfile.from_config(config), ServiceSettings.from_config(config)
+
+
+@pytest.mark.parametrize('option, value', [
+    ('openweathermap_api_key', 'other'), ('shazampi_log', 'other.log'), ('units', 'imperial'),
+    ('yamnet_threads', '4'), ('pipeline', 'True'), ('audio_gate', 'False'), ('duration_cache', 'other.json'),
+    ('display_refresh_counter', '5'), ('frame_cache_max_mb', '10'), ('virtual_refresh_seconds', '1'),
+])
+def test_non_render_options_keep_config_hash(option, value):
+    assert load(**{option: value})[0].config_hash == load()[0].config_hash
+
+
+@pytest.mark.parametrize('option, value', [
+    ('font_size_title', '40'), ('text_direction', 'top-down'), ('dither_mode', 'bayer'), ('width', '600'),
+])
+def test_render_options_change_config_hash(option, value):
+    assert load(**{option: value})[0].config_hash != load()[0].config_hash
+
+
+def test_settings_are_parsed_apart_from_the_profile():
+    profile, settings = load(pipeline='True', yamnet_threads='2')
+    assert settings.pipeline and settings.yamnet_threads == 2
+    assert not hasattr(profile, 'pipeline')
+
+
+def test_exit_threshold_above_enter_is_rejected():
+    with pytest.raises(ValueError, match='music_exit_threshold'):
+        load(music_enter_threshold='0.2', music_exit_threshold='0.3')